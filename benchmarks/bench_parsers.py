@@ -0,0 +1,196 @@
+"""
+Offline benchmark of the carsandbids spider callbacks.
+
+    python -m benchmarks.bench_parsers                   # compare against baseline.json
+    python -m benchmarks.bench_parsers --save-baseline   # record a new baseline
+    python -m benchmarks.bench_parsers --archive archive/  # add pages saved by HtmlArchiveMiddleware
+
+Every fixture page is run through its callback (`parse` for search pages,
+`parse_car` for auctions) with no browser and no network. For each page the
+report shows pages per second, time per field group of parse_car, peak Python
+memory, and a digest of the callback output. A page regresses if it gets
+slower than the baseline by more than --threshold, or if its output changes.
+Timings are only comparable with a baseline recorded on the same machine.
+"""
+import argparse
+import gc
+import hashlib
+import json
+import os
+import re
+import sys
+import time
+import tracemalloc
+
+from itemadapter import ItemAdapter
+from scrapy.http import HtmlResponse, Request
+
+from crawler.dates import parse_date, parse_datetime
+from crawler.replay import archived_response, offline_spider, read_index, run_callback
+
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+FIXTURES_DIR = os.path.join(BENCH_DIR, "fixtures")
+BASELINE_PATH = os.path.join(BENCH_DIR, "baseline.json")
+
+
+def fixture_pages(directory: str = FIXTURES_DIR) -> list:
+    """
+    (name, callback, response) for every fixture, search_* pages go to `parse`, the
+    rest to `parse_car`; a search_*_pageN page is fetched as page N
+    """
+    pages = []
+    for filename in sorted(os.listdir(directory)):
+        if not filename.endswith(".html"):
+            continue
+        name = filename[:-len(".html")]
+        if name.startswith("search"):
+            callback, url = "parse", f"https://carsandbids.com/search?q={name}"
+            page = re.search(r'_page(\d+)$', name)
+            if page:
+                url += f"&page={page.group(1)}"
+        else:
+            callback, url = "parse_car", f"https://carsandbids.com/auctions/{name}"
+        with open(os.path.join(directory, filename), "rb") as f:
+            body = f.read()
+        request = Request(url, meta={"fetch_path": "playwright", "query": name})
+        pages.append((name, callback, HtmlResponse(url=url, body=body, encoding="utf-8", request=request)))
+    return pages
+
+
+def archive_pages(directory: str) -> list:
+    return [
+        (f"archive:{entry['sha256'][:12]}", entry["callback"], archived_response(directory, entry))
+        for entry in read_index(directory)
+    ]
+
+
+def field_groups(spider) -> dict:
+    """ parse_car's extraction steps that can be timed on their own """
+    return {
+        "quick_facts": spider.extract_quick_facts,
+        "bids": spider.extract_bids,
+        "comments": spider.extract_comments,
+    }
+
+
+def clear_caches():
+    # a crawl rarely sees the same timestamp twice, keep the memo from flattering repeats
+    parse_datetime.cache_clear()
+    parse_date.cache_clear()
+
+
+def output_digest(items: list) -> str:
+    items = [ItemAdapter(item).asdict() for item in items]
+    return hashlib.sha256(json.dumps(items, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+
+def best_of(func, repeat: int) -> float:
+    timings = []
+    # like timeit, keep collector pauses out of the numbers
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            clear_caches()
+            start = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - start)
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+    return min(timings)
+
+
+def bench_page(spider, callback: str, response: HtmlResponse, repeat: int) -> dict:
+    items = run_callback(spider, response, callback)
+    seconds = best_of(lambda: run_callback(spider, response, callback), repeat)
+    result = {
+        "callback": callback,
+        "bytes": len(response.body),
+        "pages_per_second": 1 / seconds,
+        "seconds": seconds,
+        "digest": output_digest(items),
+        "fields": {},
+    }
+    if callback == "parse_car":
+        for group, extract in field_groups(spider).items():
+            result["fields"][group] = best_of(lambda: extract(response), repeat)
+        result["fields"]["other"] = max(0.0, seconds - sum(result["fields"].values()))
+
+    gc.collect()
+    clear_caches()
+    tracemalloc.start()
+    run_callback(spider, response, callback)
+    result["peak_memory_kib"] = tracemalloc.get_traced_memory()[1] / 1024
+    tracemalloc.stop()
+    return result
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    problems = []
+    for name, result in results.items():
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+        if result["digest"] != previous["digest"]:
+            problems.append(f"{name}: output changed ({previous['digest']} -> {result['digest']})")
+        slowdown = result["seconds"] / previous["seconds"] - 1
+        if slowdown > threshold:
+            problems.append(f"{name}: {slowdown:+.0%} slower than baseline")
+        for group, seconds in result["fields"].items():
+            before = previous.get("fields", {}).get(group)
+            # "other" is a difference of two timings and tiny groups are all noise,
+            # only judge measured groups worth a millisecond and a tenth of the page
+            if group == "other" or not before or seconds < max(0.001, 0.1 * result["seconds"]):
+                continue
+            if seconds / before - 1 > threshold:
+                problems.append(f"{name}/{group}: {seconds / before - 1:+.0%} slower than baseline")
+    return problems
+
+
+def report(results: dict, baseline: dict):
+    print(f"{'page':<28}{'KiB':>8}{'pages/s':>10}{'vs base':>9}{'peak KiB':>10}  field ms")
+    for name, result in results.items():
+        previous = baseline.get(name)
+        change = f"{previous['seconds'] / result['seconds'] - 1:+.0%}" if previous else "new"
+        fields = " ".join(f"{group}={seconds * 1000:.2f}" for group, seconds in result["fields"].items())
+        print(f"{name:<28}{result['bytes'] / 1024:>8.0f}{result['pages_per_second']:>10.1f}{change:>9}"
+              f"{result['peak_memory_kib']:>10.0f}  {fields}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--archive", help="also benchmark the pages of this HTML archive")
+    parser.add_argument("--repeat", type=int, default=20, help="runs per page, the fastest one counts")
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed slowdown before flagging, 0.25 = 25%%")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true", help="write the results as the new baseline")
+    args = parser.parse_args(argv)
+
+    spider = offline_spider()
+    pages = fixture_pages()
+    if args.archive:
+        pages += archive_pages(args.archive)
+    results = {name: bench_page(spider, callback, response, args.repeat) for name, callback, response in pages}
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+    report(results, baseline)
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+
+    problems = compare(results, baseline, args.threshold)
+    for problem in problems:
+        print(f"REGRESSION {problem}")
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
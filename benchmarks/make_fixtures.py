@@ -0,0 +1,118 @@
+"""
+Generate the synthetic carsandbids.com pages used by bench_parsers.py.
+
+    python benchmarks/make_fixtures.py
+
+The markup mirrors what the spider's XPath expressions expect from rendered
+pages. Output is deterministic, so regenerating only changes the fixtures when
+this script changes.
+"""
+import os
+import random
+from html import escape
+
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+MAKES = ["Porsche", "BMW", "Mercedes-Benz", "Audi", "Toyota", "Ford", "Lexus", "Honda"]
+WORDS = ("clean carfax service records original paint garage kept manual swap tires recent "
+         "inspection dealer maintained stock exhaust sunroof leather heated seats brakes").split()
+
+
+def sentence(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+
+def search_page(rng: random.Random, results: int, pages: int, current: int = 1, window: int = 0) -> str:
+    """ results page; with a `window`, the paginator only shows that many page numbers around `current` """
+    items = []
+    for i in range(results):
+        year, make = rng.randint(1990, 2023), rng.choice(MAKES)
+        items.append(
+            f"<li class='auction-item'><div class='auction-title'><a class='hero' href='/auctions/{i:05d}/{year}-{make.lower()}'>"
+            f"<img src='/photos/{i}.jpg'></a><h3>{year} {escape(make)}</h3></div>"
+            f"<ul class='auction-subtitle'><li>{escape(sentence(rng, 6))}</li></ul>"
+            f"<p class='location'>Los Angeles, CA 900{i % 100:02d}</p>"
+            f"<div class='item-results'><span class='bid-value'>${rng.randint(5, 200)},{rng.randint(0, 999):03d}</span></div></li>"
+        )
+    first, last = 1, pages
+    if window:
+        first = max(1, min(current - window // 2, pages - window + 1))
+        last = min(pages, first + window - 1)
+    buttons = "".join(f"<li class='num'><button>{n}</button></li>" for n in range(first, last + 1))
+    prev_disabled = " disabled" if current == 1 else ""
+    next_disabled = " disabled" if current == pages else ""
+    return (
+        "<!DOCTYPE html><html><head><title>Search | Cars &amp; Bids</title></head><body><div id='root'>"
+        "<ul class='auctions-list past-auctions'>" + "".join(items) + "</ul>"
+        f"<ul class='paginator'><li class='arrow prev'><button{prev_disabled}>&lt;</button></li>" + buttons +
+        f"<li class='arrow next'><button{next_disabled}>&gt;</button></li></ul></div></body></html>"
+    )
+
+
+def auction_page(rng: random.Random, bids: int, comments: int, ended: bool = True) -> str:
+    year, make = rng.randint(1990, 2023), rng.choice(MAKES)
+    facts = [
+        ("Make", f"<a href='/search?q={make}'>{escape(make)}</a>"), ("Model", "<a>911 Carrera</a>"),
+        ("Mileage", f"{rng.randint(1, 150)},{rng.randint(0, 999):03d}"), ("VIN", f"WP0AB2A9{rng.randint(10**8, 10**9)}"),
+        ("Title Status", "Clean (CA)"), ("Location", "<a>Los Angeles, CA 90001</a>"),
+        ("Seller", "<a class='user' title='seller1'>seller1</a>"), ("Engine", "3.6L Flat-6"),
+        ("Drivetrain", "Rear-wheel drive"), ("Transmission", "Manual (6-Speed)"), ("Body Style", "Coupe"),
+        ("Exterior Color", "Guards Red"), ("Interior Color", "Black"), ("Seller Type", "Private Party"),
+    ]
+    quick_facts = "".join(
+        "<dl>" + "".join(f"<dt>{label}</dt><dd>{value}</dd>" for label, value in facts[start:start + 7]) + "</dl>"
+        for start in (0, 7)
+    )
+    thread = []
+    remaining_bids = bids
+    amount = rng.randint(1, 20) * 1000
+    for i in range(bids + comments):
+        month, day, hour, minute = rng.randint(1, 12), rng.randint(1, 28), rng.randint(1, 12), rng.randint(0, 59)
+        time_span = f"<span class='time' data-full='{month}/{day}/23 {hour}:{minute:02d} {rng.choice(['AM', 'PM'])}'>{hour}h</span>"
+        user = f"user{rng.randint(1, 5000)}"
+        if i % (1 + comments // max(bids, 1)) == 0 and remaining_bids:
+            remaining_bids -= 1
+            amount += rng.randint(1, 20) * 100
+            thread.append(
+                f"<li class='bid'><div class='username'><div class='text'><a class='user' title='{user}'>{user}</a>{time_span}</div></div>"
+                f"<div class='text'>{time_span}</div><dl><dt>Bid</dt><dd>${amount:,}</dd></dl></li>"
+            )
+        else:
+            thread.append(
+                f"<li class='comment'><div class='username'><div class='text'><a class='user' title='{user}'>{user}</a></div></div>"
+                f"<div class='message'><p>{escape(sentence(rng, rng.randint(5, 60)))}</p><p>{escape(sentence(rng, 8))}</p></div></li>"
+            )
+    status = "<span class='time-ended'>Ended March 14, 2023</span>" if ended else "<span class='ticking'>2 Days</span>"
+    return (
+        f"<!DOCTYPE html><html><head><title>{year} {escape(make)} 911 Carrera | Cars &amp; Bids</title></head><body><div id='root'>"
+        f"<div class='row auction-heading'><div class='auction-title'><h1>{year} {escape(make)}</h1></div>"
+        f"<div><h2>{escape(sentence(rng, 8))}</h2></div></div>"
+        f"<div class='current-bid'><span class='bid-value'>${amount:,}</span></div>{status}"
+        f"<ul class='stats'><li class='num-bids'><span class='value'>{bids}</span></li>"
+        f"<li class='num-comments'><span class='value'>{comments}</span></li></ul>"
+        f"<div class='quick-facts'>{quick_facts}</div>"
+        f"<div class='detail-section'>{''.join(f'<p>{escape(sentence(rng, 30))}</p>' for _ in range(20))}</div>"
+        f"<ul class='thread'>{''.join(thread)}</ul></div></body></html>"
+    )
+
+
+FIXTURES = {
+    "search_50.html": lambda rng: search_page(rng, results=50, pages=12),
+    # a search_*_pageN fixture is fetched as page N, this one shows pages 3 to 7 of 12
+    "search_windowed_page5.html": lambda rng: search_page(rng, results=50, pages=12, current=5, window=5),
+    "auction_small.html": lambda rng: auction_page(rng, bids=12, comments=25),
+    "auction_large.html": lambda rng: auction_page(rng, bids=350, comments=600),
+    "auction_live.html": lambda rng: auction_page(rng, bids=40, comments=80, ended=False),
+}
+
+
+def main():
+    os.makedirs(FIXTURES_DIR, exist_ok=True)
+    for name, build in FIXTURES.items():
+        with open(os.path.join(FIXTURES_DIR, name), "w", encoding="utf-8") as f:
+            f.write(build(random.Random(name)))
+        print(f"wrote {name}")
+
+
+if __name__ == "__main__":
+    main()
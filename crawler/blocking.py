@@ -0,0 +1,136 @@
+# Rules deciding which sub-requests of a browser page are aborted.
+#
+# Pages only need their document, scripts and the XHR/fetch calls that render
+# auctions; everything else is bandwidth and time spent in the remote browser.
+# Rules are compiled once, and the domain verdict is cached per host since a
+# page hits the same few hosts hundreds of times.
+import re
+from typing import Iterable, Optional
+
+
+# Playwright resource types, see https://playwright.dev/python/docs/api/class-request#request-resource-type
+BLOCKED_RESOURCE_TYPES = ('image', 'media', 'font', 'stylesheet', 'texttrack', 'manifest')
+ALLOWED_DOMAINS = ('carsandbids.com',)
+DENIED_DOMAINS = (
+    'google-analytics.com', 'googletagmanager.com', 'doubleclick.net', 'facebook.net', 'facebook.com',
+    'hotjar.com', 'segment.io', 'segment.com', 'sentry.io', 'intercom.io', 'googlesyndication.com',
+)
+BLOCKED_URL_PATTERNS = (
+    r'\.(?:jpe?g|png|gif|webp|avif|svg|ico|bmp|mp4|webm|m3u8|woff2?|ttf|otf|css)(?:[?#]|$)',
+    r'/(?:analytics|collect|pixel|beacon|track(?:ing)?)(?:[/?#]|$)',
+)
+# average transfer size of what gets blocked, a blocked request has no size to measure
+ESTIMATED_BYTES = {
+    'image': 120_000, 'media': 1_000_000, 'font': 40_000, 'stylesheet': 30_000,
+    'script': 60_000, 'texttrack': 5_000, 'manifest': 2_000,
+}
+DEFAULT_ESTIMATED_BYTES = 10_000
+
+
+def url_host(url: str) -> str:
+    """ lowercase host of an absolute URL, without urlparse's allocations """
+    _, sep, rest = url.partition('://')
+    if not sep:
+        return ''
+    netloc = rest.split('/', 1)[0].split('?', 1)[0].split('#', 1)[0]
+    host = netloc.rpartition('@')[2]
+    if host.startswith('['):
+        return host[:host.find(']') + 1].lower()
+    return host.split(':', 1)[0].lower()
+
+
+def _domains(domains: Iterable[str]) -> frozenset:
+    return frozenset(domain.lower().lstrip('.') for domain in domains if domain)
+
+
+class ResourceBlocker:
+    """
+    PLAYWRIGHT_ABORT_REQUEST callable built from the RESOURCE_BLOCKING_* settings.
+
+    A sub-request is aborted when, checked in this order:
+
+    - its host is under one of RESOURCE_BLOCKING_DENIED_DOMAINS, or
+      RESOURCE_BLOCKING_ALLOWED_DOMAINS is not empty and the host is under none of them
+    - its resource type is one of RESOURCE_BLOCKING_RESOURCE_TYPES
+    - its URL matches one of RESOURCE_BLOCKING_URL_PATTERNS
+
+    A domain matches its subdomains too. Counts of blocked requests by reason and
+    by resource type, allowed requests and the estimated bytes saved (from
+    RESOURCE_BLOCKING_ESTIMATED_BYTES, per resource type) go to the crawl stats.
+    """
+
+    def __init__(
+        self,
+        stats=None,
+        resource_types: Iterable[str] = BLOCKED_RESOURCE_TYPES,
+        allowed_domains: Iterable[str] = ALLOWED_DOMAINS,
+        denied_domains: Iterable[str] = DENIED_DOMAINS,
+        url_patterns: Iterable[str] = BLOCKED_URL_PATTERNS,
+        estimated_bytes: Optional[dict] = None,
+    ):
+        self.stats = stats
+        self.resource_types = frozenset(resource_types)
+        self.allowed_domains = _domains(allowed_domains)
+        self.denied_domains = _domains(denied_domains)
+        url_patterns = list(url_patterns)
+        self.url_pattern = re.compile('|'.join(f'(?:{p})' for p in url_patterns), re.IGNORECASE) if url_patterns else None
+        self.estimated_bytes = dict(ESTIMATED_BYTES, **(estimated_bytes or {}))
+        self.host_verdicts = {}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        return cls(
+            stats=crawler.stats,
+            resource_types=settings.getlist("RESOURCE_BLOCKING_RESOURCE_TYPES", BLOCKED_RESOURCE_TYPES),
+            allowed_domains=settings.getlist("RESOURCE_BLOCKING_ALLOWED_DOMAINS", ALLOWED_DOMAINS),
+            denied_domains=settings.getlist("RESOURCE_BLOCKING_DENIED_DOMAINS", DENIED_DOMAINS),
+            url_patterns=settings.getlist("RESOURCE_BLOCKING_URL_PATTERNS", BLOCKED_URL_PATTERNS),
+            estimated_bytes=settings.getdict("RESOURCE_BLOCKING_ESTIMATED_BYTES"),
+        )
+
+    def _under(self, host: str, domains: frozenset) -> bool:
+        while host:
+            if host in domains:
+                return True
+            host = host.partition('.')[2]
+        return False
+
+    def host_verdict(self, host: str) -> Optional[str]:
+        """ reason to block everything from `host`, None when its requests go on to the other rules """
+        try:
+            return self.host_verdicts[host]
+        except KeyError:
+            pass
+        if self._under(host, self.denied_domains):
+            verdict = 'domain_denied'
+        elif self.allowed_domains and not self._under(host, self.allowed_domains):
+            verdict = 'domain_not_allowed'
+        else:
+            verdict = None
+        self.host_verdicts[host] = verdict
+        return verdict
+
+    def block_reason(self, url: str, resource_type: str) -> Optional[str]:
+        reason = self.host_verdict(url_host(url))
+        if reason is None:
+            if resource_type in self.resource_types:
+                reason = 'resource_type'
+            elif self.url_pattern is not None and self.url_pattern.search(url):
+                reason = 'url_pattern'
+        return reason
+
+    def __call__(self, request) -> bool:
+        resource_type = request.resource_type
+        reason = self.block_reason(request.url, resource_type)
+        if self.stats is not None:
+            if reason is None:
+                self.stats.inc_value("resource_blocking/allowed")
+            else:
+                self.stats.inc_value(f"resource_blocking/blocked/{reason}")
+                self.stats.inc_value(f"resource_blocking/blocked_type/{resource_type}")
+                self.stats.inc_value(
+                    "resource_blocking/bytes_saved_estimate",
+                    self.estimated_bytes.get(resource_type, DEFAULT_ESTIMATED_BYTES),
+                )
+        return reason is not None
@@ -0,0 +1,84 @@
+# Date helpers for the formats carsandbids.com renders.
+#
+# strptime() against the handful of known formats is orders of magnitude faster
+# than dateparser, which is kept only as a fallback for anything unexpected.
+import datetime
+import re
+from functools import lru_cache
+from typing import Optional
+
+import dateparser
+
+
+# `data-full` attribute of a bid's time, e.g. "Jan 24, 2023 4:37 PM" or "1/24/23 4:37 PM"
+TIMESTAMP_FORMATS = (
+    '%b %d, %Y %I:%M %p',
+    '%B %d, %Y %I:%M %p',
+    '%m/%d/%y %I:%M %p',
+    '%m/%d/%Y %I:%M %p',
+    '%b %d, %Y %I:%M:%S %p',
+    '%Y-%m-%dT%H:%M:%S.%fZ',
+    '%Y-%m-%dT%H:%M:%SZ',
+)
+# `time-ended` span of a finished auction, e.g. "Ended January 24, 2023"
+DATE_FORMATS = (
+    '%b %d, %Y',
+    '%B %d, %Y',
+    '%m/%d/%y',
+    '%m/%d/%Y',
+)
+ENDED_PREFIX = re.compile(r'^\s*(ended|sold|ends?)\b:?\s*', re.IGNORECASE)
+# countdown of a live auction, e.g. "2 Days", "5 Hours 12 Min" or "04:32:10"
+COUNTDOWN_PART = re.compile(r'(\d+)\s*(d|h|m|s)[a-z]*\b', re.IGNORECASE)
+COUNTDOWN_CLOCK = re.compile(r'(?:(\d+):)?(\d{1,2}):(\d{2})\b')
+COUNTDOWN_UNITS = {'d': 86400, 'h': 3600, 'm': 60, 's': 1}
+
+
+def _strptime(value: str, formats) -> Optional[datetime.datetime]:
+    for fmt in formats:
+        try:
+            parsed = datetime.datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+        if fmt.endswith('Z'):
+            parsed = parsed.replace(tzinfo=datetime.timezone.utc)
+        return parsed
+    return None
+
+
+@lru_cache(maxsize=8192)
+def parse_datetime(value: str) -> Optional[datetime.datetime]:
+    """ bid time -> datetime, None when neither the known formats nor dateparser understand it """
+    if not value:
+        return None
+    value = " ".join(value.split())
+    return _strptime(value, TIMESTAMP_FORMATS) or dateparser.parse(value)
+
+
+def parse_timestamp(value: str) -> Optional[int]:
+    parsed = parse_datetime(value)
+    return int(parsed.timestamp()) if parsed else None
+
+
+@lru_cache(maxsize=4096)
+def parse_date(value: str) -> Optional[datetime.date]:
+    """ auction end text -> date, None when it can't be parsed """
+    if not value:
+        return None
+    value = ENDED_PREFIX.sub('', " ".join(value.split()))
+    parsed = _strptime(value, DATE_FORMATS) or _strptime(value, TIMESTAMP_FORMATS) or dateparser.parse(value)
+    return parsed.date() if parsed else None
+
+
+def parse_countdown(value: str) -> Optional[int]:
+    """ time left on a live auction's countdown, in seconds, None when it can't be parsed """
+    if not value:
+        return None
+    clock = COUNTDOWN_CLOCK.search(value)
+    if clock:
+        hours, minutes, seconds = clock.groups()
+        return int(hours or 0) * 3600 + int(minutes) * 60 + int(seconds)
+    parts = COUNTDOWN_PART.findall(value)
+    if not parts:
+        return None
+    return sum(int(number) * COUNTDOWN_UNITS[unit.lower()] for number, unit in parts)
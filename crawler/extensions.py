@@ -0,0 +1,273 @@
+# Define here your extensions
+#
+# See documentation in:
+# https://docs.scrapy.org/en/latest/topics/extensions.html
+import bisect
+import json
+import logging
+import os
+import statistics
+import urllib.request
+
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from scrapy.utils.defer import deferred_from_coro
+from twisted.internet import task, threads
+
+from crawler.frontier import worker_path
+from crawler.signals import stage_timed
+
+
+logger = logging.getLogger(__name__)
+
+
+class Histogram:
+    """ cumulative-bucket latency histogram, as Prometheus expects them """
+    buckets = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float:
+        """ upper bound of the bucket holding the q-th quantile """
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+    def cumulative(self):
+        total = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            yield ('+Inf' if bound == float('inf') else f"{bound:g}"), total
+
+
+class StageMetrics:
+    """
+    Keeps per-stage latency histograms of every request, fed by the stage_timed
+    signal, and writes them with error, timeout and abort counts in the
+    Prometheus text format to METRICS_FILE every METRICS_EXPORT_INTERVAL seconds.
+    The file can be served as-is or picked up by node_exporter's textfile
+    collector. Stage means and upper bounds of p50/p95 go to the crawl stats when
+    the spider closes.
+    """
+
+    def __init__(self, crawler, path: str, interval: float):
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.path = path
+        self.interval = interval
+        self.histograms = {}
+        self.exporter = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        path = crawler.settings.get("METRICS_FILE")
+        if not path:
+            raise NotConfigured("METRICS_FILE is not set")
+        # workers of a shared-frontier crawl would overwrite one another's file
+        ext = cls(crawler, worker_path(crawler.settings, path), crawler.settings.getfloat("METRICS_EXPORT_INTERVAL", 15))
+        crawler.signals.connect(ext.stage_timed, signal=stage_timed)
+        crawler.signals.connect(ext.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(ext.spider_closed, signal=signals.spider_closed)
+        return ext
+
+    def stage_timed(self, stage, seconds, request, spider):
+        histogram = self.histograms.get(stage)
+        if histogram is None:
+            histogram = self.histograms[stage] = Histogram()
+        histogram.observe(seconds)
+
+    def spider_opened(self, spider):
+        self.exporter = task.LoopingCall(self.export)
+        self.exporter.start(self.interval, now=False)
+
+    def spider_closed(self, spider, reason):
+        if self.exporter is not None and self.exporter.running:
+            self.exporter.stop()
+        self.export()
+        for stage, histogram in self.histograms.items():
+            self.stats.set_value(f"stage_latency/{stage}/count", histogram.count)
+            self.stats.set_value(f"stage_latency/{stage}/mean", round(histogram.sum / histogram.count, 3))
+            self.stats.set_value(f"stage_latency/{stage}/p50_le", histogram.quantile(0.5))
+            self.stats.set_value(f"stage_latency/{stage}/p95_le", histogram.quantile(0.95))
+
+    def render(self) -> str:
+        lines = [
+            "# HELP crawler_stage_seconds Time spent by requests in each stage.",
+            "# TYPE crawler_stage_seconds histogram",
+        ]
+        for stage, histogram in sorted(self.histograms.items()):
+            for bound, count in histogram.cumulative():
+                lines.append(f'crawler_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {count}')
+            lines.append(f'crawler_stage_seconds_sum{{stage="{stage}"}} {histogram.sum:.6f}')
+            lines.append(f'crawler_stage_seconds_count{{stage="{stage}"}} {histogram.count}')
+
+        stats = self.stats.get_stats()
+        counters = (
+            ("crawler_request_errors_total", "Download errors by exception class.", "stage_timing/errors/", "exception"),
+            ("crawler_responses_total", "Responses by status code.", "downloader/response_status_count/", "status"),
+        )
+        for name, help_text, prefix, label in counters:
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+            for key, value in sorted(stats.items()):
+                if key.startswith(prefix):
+                    lines.append(f'{name}{{{label}="{key[len(prefix):]}"}} {value}')
+        totals = (
+            ("crawler_request_timeouts_total", "Requests that timed out.", "stage_timing/timeouts"),
+            ("crawler_requests_dropped_total", "Requests dropped before download.", "stage_timing/dropped"),
+            ("crawler_browser_requests_aborted_total", "Browser sub-requests aborted.", "playwright/request_count/aborted"),
+            ("crawler_browser_bytes_saved_estimate_total", "Estimated bytes not downloaded by aborted sub-requests.",
+             "resource_blocking/bytes_saved_estimate"),
+            ("crawler_items_scraped_total", "Items scraped.", "item_scraped_count"),
+        )
+        for name, help_text, key in totals:
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter", f"{name} {stats.get(key, 0)}"]
+        return "\n".join(lines) + "\n"
+
+    def export(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(self.render())
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning(f"Could not write metrics to {self.path}: {e}")
+
+
+class AdaptiveConcurrency:
+    """
+    Feedback controller for the number of browser pages in flight, in the spirit
+    of AutoThrottle but driven by page latency, error rate and the health of the
+    remote browser rather than by a download delay.
+
+    Browser requests share the ADAPTIVE_CONCURRENCY_SLOT download slot (the
+    spider puts them there), whose concurrency starts at ADAPTIVE_CONCURRENCY_START
+    and is adjusted every ADAPTIVE_CONCURRENCY_INTERVAL seconds:
+
+    - cut by ADAPTIVE_CONCURRENCY_BACKOFF when the browser looks unhealthy, more
+      than ADAPTIVE_CONCURRENCY_MAX_ERROR_RATE of requests failed, or the median
+      page latency exceeds twice ADAPTIVE_CONCURRENCY_TARGET_LATENCY
+    - raised by one page when the slot is saturated, nothing failed and the median
+      latency is under the target
+    - always kept within ADAPTIVE_CONCURRENCY_MIN..ADAPTIVE_CONCURRENCY_MAX
+
+    With ADAPTIVE_CONCURRENCY_HEALTH_URL set, that URL is polled every interval.
+    A failed poll, or a JSON body saying `"isAvailable": false` (the shape of
+    browserless' /pressure endpoint), counts as unhealthy.
+    """
+
+    def __init__(self, crawler):
+        settings = crawler.settings
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.slot_key = settings.get("ADAPTIVE_CONCURRENCY_SLOT", "browser")
+        self.min = settings.getint("ADAPTIVE_CONCURRENCY_MIN", 1)
+        self.max = settings.getint("ADAPTIVE_CONCURRENCY_MAX", settings.getint("CONCURRENT_REQUESTS"))
+        self.concurrency = min(self.max, max(self.min, settings.getint("ADAPTIVE_CONCURRENCY_START", self.min)))
+        self.interval = settings.getfloat("ADAPTIVE_CONCURRENCY_INTERVAL", 10)
+        self.target_latency = settings.getfloat("ADAPTIVE_CONCURRENCY_TARGET_LATENCY", 15)
+        self.max_error_rate = settings.getfloat("ADAPTIVE_CONCURRENCY_MAX_ERROR_RATE", 0.1)
+        self.backoff = settings.getfloat("ADAPTIVE_CONCURRENCY_BACKOFF", 0.7)
+        self.health_url = settings.get("ADAPTIVE_CONCURRENCY_HEALTH_URL")
+        self.debug = settings.getbool("ADAPTIVE_CONCURRENCY_DEBUG")
+        self.latencies = []
+        self.finished = 0
+        self.failed = 0
+        self.healthy = True
+        self.loop = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool("ADAPTIVE_CONCURRENCY_ENABLED"):
+            raise NotConfigured
+        ext = cls(crawler)
+        crawler.signals.connect(ext.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(ext.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(ext.response_received, signal=signals.response_received)
+        crawler.signals.connect(ext.request_left_downloader, signal=signals.request_left_downloader)
+        return ext
+
+    def _is_browser(self, request) -> bool:
+        return request.meta.get("download_slot") == self.slot_key
+
+    def spider_opened(self, spider):
+        self.stats.set_value("adaptive_concurrency/current", self.concurrency)
+        self.loop = task.LoopingCall(lambda: deferred_from_coro(self.adjust()))
+        self.loop.start(self.interval, now=False)
+
+    def spider_closed(self, spider, reason):
+        if self.loop is not None and self.loop.running:
+            self.loop.stop()
+
+    def response_received(self, response, request, spider):
+        if not self._is_browser(request):
+            return
+        latency = request.meta.get("download_latency")
+        if latency is not None:
+            self.latencies.append(latency)
+        if response.status == 429 or response.status >= 500:
+            self.failed += 1
+
+    def request_left_downloader(self, request, spider):
+        if self._is_browser(request):
+            self.finished += 1
+
+    def _slot(self):
+        return self.crawler.engine.downloader.slots.get(self.slot_key)
+
+    def _fetch_health(self) -> bool:
+        with urllib.request.urlopen(self.health_url, timeout=min(self.interval, 10)) as response:
+            body = json.loads(response.read() or b"{}")
+        pressure = body.get("pressure", body) if isinstance(body, dict) else {}
+        return pressure.get("isAvailable", True) is not False
+
+    async def _check_health(self):
+        try:
+            self.healthy = await threads.deferToThread(self._fetch_health)
+        except Exception as e:
+            logger.warning(f"Browser health check failed: {e!r}")
+            self.healthy = False
+
+    async def adjust(self):
+        if self.health_url:
+            await self._check_health()
+        slot = self._slot()
+        latencies, self.latencies = self.latencies, []
+        # requests that left the downloader without a response failed outright
+        failed = self.failed + max(0, self.finished - len(latencies))
+        error_rate = failed / self.finished if self.finished else 0.0
+        self.finished = self.failed = 0
+        latency = statistics.median(latencies) if latencies else None
+        saturated = slot is not None and (slot.queue or len(slot.transferring) >= slot.concurrency)
+
+        previous = self.concurrency
+        if not self.healthy or error_rate > self.max_error_rate or (latency and latency > 2 * self.target_latency):
+            self.concurrency = max(self.min, int(self.concurrency * self.backoff))
+        elif saturated and not failed and latency and latency < self.target_latency:
+            self.concurrency = min(self.max, self.concurrency + 1)
+
+        if slot is not None:
+            slot.concurrency = self.concurrency
+        self.stats.set_value("adaptive_concurrency/current", self.concurrency)
+        self.stats.max_value("adaptive_concurrency/max", self.concurrency)
+        self.stats.min_value("adaptive_concurrency/min", self.concurrency)
+        if self.debug or previous != self.concurrency:
+            logger.info(
+                f"Browser concurrency {previous} -> {self.concurrency} "
+                f"(median latency {latency if latency is None else round(latency, 1)}s, "
+                f"error rate {error_rate:.0%}, healthy {self.healthy}, saturated {bool(saturated)})"
+            )
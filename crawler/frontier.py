@@ -0,0 +1,364 @@
+# Shared frontier, so one crawl can be split over several worker processes or
+# machines: all of them pull requests from one queue and filter them against one
+# seen-set, and a URL is fetched once no matter which worker found it.
+#
+#     scrapy crawl carsandbids -a queries_file=sweep.csv -s SCHEDULER=crawler.frontier.SharedScheduler
+#
+# started once per worker, with the same arguments. Start requests are filtered
+# like any other, so the first worker to run them seeds the frontier.
+import inspect
+import logging
+import os
+import pickle
+import socket
+import sqlite3
+import time
+from collections import deque
+from typing import Optional
+
+from scrapy import Request
+from scrapy.core.scheduler import BaseScheduler
+from scrapy.dupefilters import RFPDupeFilter
+from scrapy.exceptions import NotConfigured
+from scrapy.utils.misc import arg_to_iter, build_from_crawler, load_object
+from scrapy.utils.request import request_from_dict
+from twisted.python.failure import Failure
+
+from crawler.signals import request_processed
+
+
+logger = logging.getLogger(__name__)
+
+
+def worker_id() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+def uses_shared_frontier(settings) -> bool:
+    # not issubclass(), BaseScheduler's metaclass takes any scheduler for a subclass
+    return SharedScheduler in load_object(settings.get("SCHEDULER")).__mro__
+
+
+def worker_path(settings, path: str) -> str:
+    """ `path` with the worker id before its extension when SharedScheduler is in use, for per-worker output files """
+    if not uses_shared_frontier(settings):
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}-{worker_id()}{ext}"
+
+
+class SqliteFrontier:
+    """
+    Frontier backend on a SQLite file, for workers sharing a disk; SQLite over a
+    network file system is not safe, workers on other machines need a backend on a
+    server. FRONTIER_BACKEND can name any class with the same methods:
+
+    - add_seen(fingerprint) -> bool: record a request fingerprint, False if it was known
+    - push(fingerprint, priority, data): queue a serialized request
+    - pop(worker) -> (id, data) or None: lease the highest priority request
+    - done(id): forget a leased request once it has been downloaded
+    - queued() / leased(): counts of waiting and in-progress requests, all workers
+    - reset() -> bool: forget the crawl's seen-set, False if requests are still queued or leased
+    - close()
+
+    Every row belongs to the crawl named FRONTIER_CRAWL, by default the spider
+    name and the day the worker started, so workers started together share a
+    crawl and a daily job starts a new one. SharedScheduler also resets the crawl
+    once its queue and leases have drained, so running the same command again
+    on the same day starts over instead of filtering everything. A lease not done
+    within FRONTIER_LEASE_TIMEOUT seconds is handed out again, which covers
+    workers that died mid-request.
+    """
+
+    def __init__(self, path: str, crawl: str, lease_timeout: float = 600):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.crawl = crawl
+        self.lease_timeout = lease_timeout
+        # other workers hold the write lock for a moment on every push and pop
+        self.conn = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS seen ("
+            " crawl TEXT NOT NULL,"
+            " fingerprint TEXT NOT NULL,"
+            " PRIMARY KEY (crawl, fingerprint))"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS requests ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " crawl TEXT NOT NULL,"
+            " fingerprint TEXT,"
+            " priority INTEGER NOT NULL,"
+            " data BLOB NOT NULL,"
+            " worker TEXT,"
+            " leased_at REAL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS requests_next ON requests (crawl, worker, priority DESC, id)")
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        return cls(
+            path=settings.get("FRONTIER_PATH", "state/frontier.sqlite"),
+            crawl=settings.get("FRONTIER_CRAWL") or f"{crawler.spidercls.name}-{time.strftime('%Y%m%d')}",
+            lease_timeout=settings.getfloat("FRONTIER_LEASE_TIMEOUT", 600),
+        )
+
+    def add_seen(self, fingerprint: str) -> bool:
+        cursor = self.conn.execute(
+            "INSERT OR IGNORE INTO seen (crawl, fingerprint) VALUES (?, ?)", (self.crawl, fingerprint)
+        )
+        return cursor.rowcount == 1
+
+    def push(self, fingerprint: Optional[str], priority: int, data: bytes):
+        self.conn.execute(
+            "INSERT INTO requests (crawl, fingerprint, priority, data) VALUES (?, ?, ?, ?)",
+            (self.crawl, fingerprint, priority, data),
+        )
+
+    def pop(self, worker: str) -> Optional[tuple]:
+        now = time.time()
+        # a single statement, so two workers can never lease the same row
+        row = self.conn.execute(
+            "UPDATE requests SET worker = ?, leased_at = ? WHERE id = ("
+            " SELECT id FROM requests WHERE crawl = ? AND (worker IS NULL OR leased_at < ?)"
+            " ORDER BY priority DESC, id LIMIT 1)"
+            " RETURNING id, data",
+            (worker, now, self.crawl, now - self.lease_timeout),
+        ).fetchone()
+        return tuple(row) if row else None
+
+    def done(self, request_id: int):
+        self.conn.execute("DELETE FROM requests WHERE id = ?", (request_id,))
+
+    def queued(self) -> int:
+        return self.conn.execute(
+            "SELECT COUNT(*) FROM requests WHERE crawl = ? AND (worker IS NULL OR leased_at < ?)",
+            (self.crawl, time.time() - self.lease_timeout),
+        ).fetchone()[0]
+
+    def leased(self) -> int:
+        return self.conn.execute(
+            "SELECT COUNT(*) FROM requests WHERE crawl = ? AND worker IS NOT NULL AND leased_at >= ?",
+            (self.crawl, time.time() - self.lease_timeout),
+        ).fetchone()[0]
+
+    def reset(self) -> bool:
+        # one statement, so a request pushed by another worker meanwhile keeps the crawl going
+        self.conn.execute(
+            "DELETE FROM seen WHERE crawl = ? AND NOT EXISTS (SELECT 1 FROM requests WHERE crawl = ?)",
+            (self.crawl, self.crawl),
+        )
+        return not self.conn.execute("SELECT 1 FROM seen WHERE crawl = ? LIMIT 1", (self.crawl,)).fetchone()
+
+    def close(self):
+        self.conn.close()
+
+
+def frontier_backend(crawler):
+    return build_from_crawler(load_object(crawler.settings.get("FRONTIER_BACKEND", SqliteFrontier)), crawler)
+
+
+class SharedDupeFilter(RFPDupeFilter):
+    """ RFPDupeFilter whose seen-set lives in the FRONTIER_BACKEND, shared by all workers of a crawl """
+
+    def __init__(self, frontier, debug: bool = False, *, fingerprinter=None):
+        super().__init__(debug=debug, fingerprinter=fingerprinter)
+        self.frontier = frontier
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(
+            frontier_backend(crawler),
+            debug=crawler.settings.getbool("DUPEFILTER_DEBUG"),
+            fingerprinter=crawler.request_fingerprinter,
+        )
+
+    def request_seen(self, request) -> bool:
+        return not self.frontier.add_seen(self.request_fingerprint(request))
+
+    def close(self, reason: str):
+        self.frontier.close()
+
+
+class SharedScheduler(BaseScheduler):
+    """
+    Scheduler keeping its queue in the FRONTIER_BACKEND, shared with the other
+    workers of the crawl, and filtering with SharedDupeFilter.
+
+    Requests are stored pickled, as Scrapy's disk queues do; one that can't be
+    pickled stays in a local memory queue. A request handed to this worker is
+    leased, and removed from the frontier once the requests its callback or
+    errback produced are in it (see FrontierLeaseMiddleware and LeasedErrback),
+    or once a downloader middleware replaced it, e.g. with a redirect or retry.
+    As long as any worker holds a lease the crawl isn't over, since that request
+    may yield more, so idle workers keep polling until the whole frontier drains.
+    """
+
+    def __init__(self, crawler, frontier, dupefilter):
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.frontier = frontier
+        self.df = dupefilter
+        self.worker = worker_id()
+        self.local = deque()
+        self.spider = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        scheduler = cls(crawler, frontier_backend(crawler), SharedDupeFilter.from_crawler(crawler))
+        crawler.signals.connect(scheduler.request_done, signal=request_processed)
+        return scheduler
+
+    def open(self, spider):
+        self.spider = spider
+        logger.info(f"Worker {self.worker} joined crawl {self.frontier.crawl!r}, {self.frontier.queued()} requests queued")
+        return self.df.open()
+
+    def close(self, reason: str):
+        if self.local:
+            logger.warning(f"{len(self.local)} unserializable requests were left in the local queue")
+        # once the crawl is complete, a later run of the same command must not find it all seen
+        if not self.frontier.queued() and not self.frontier.leased() and self.frontier.reset():
+            logger.info(f"Crawl {self.frontier.crawl!r} drained, its seen-set was reset")
+        self.frontier.close()
+        return self.df.close(reason)
+
+    def has_pending_requests(self) -> bool:
+        return bool(self.local) or self.frontier.queued() > 0 or self.frontier.leased() > 0
+
+    def __len__(self) -> int:
+        return len(self.local) + self.frontier.queued()
+
+    def enqueue_request(self, request) -> bool:
+        # a redirect or retry of a leased request takes over from it
+        previous = request.meta.pop("frontier_id", None)
+        if isinstance(request.errback, LeasedErrback):
+            request = request.replace(errback=request.errback.errback)
+        try:
+            return self._enqueue(request)
+        finally:
+            if previous is not None:
+                self.frontier.done(previous)
+
+    def _enqueue(self, request) -> bool:
+        if not request.dont_filter and self.df.request_seen(request):
+            self.df.log(request, self.spider)
+            return False
+        try:
+            data = pickle.dumps(request.to_dict(spider=self.spider), protocol=4)
+        except Exception as e:
+            logger.debug(f"Keeping unserializable request {request} in the local queue: {e!r}")
+            self.local.append(request)
+            self.stats.inc_value("scheduler/enqueued/memory")
+        else:
+            self.frontier.push(self.df.request_fingerprint(request), request.priority, data)
+            self.stats.inc_value("scheduler/enqueued/frontier")
+        self.stats.inc_value("scheduler/enqueued")
+        return True
+
+    def next_request(self):
+        if self.local:
+            self.stats.inc_value("scheduler/dequeued/memory")
+            self.stats.inc_value("scheduler/dequeued")
+            return self.local.popleft()
+        leased = self.frontier.pop(self.worker)
+        if leased is None:
+            return None
+        frontier_id, data = leased
+        request = request_from_dict(pickle.loads(data), spider=self.spider)
+        request.meta["frontier_id"] = frontier_id
+        # failed downloads go straight to the errback, spider middleware never sees them
+        request.errback = LeasedErrback(self.crawler, request.errback)
+        self.stats.inc_value("scheduler/dequeued/frontier")
+        self.stats.inc_value("scheduler/dequeued")
+        return request
+
+    def request_done(self, request, spider):
+        frontier_id = request.meta.pop("frontier_id", None)
+        if frontier_id is not None:
+            self.frontier.done(frontier_id)
+
+
+class LeasedErrback:
+    """
+    Errback of a request leased from the frontier: calls the request's own errback,
+    if any, schedules the requests it returns and then ends the lease. Never
+    stored, SharedScheduler puts the original errback back first.
+    """
+
+    def __init__(self, crawler, errback=None):
+        self.crawler = crawler
+        self.errback = errback
+        self.__name__ = getattr(errback, "__name__", "errback")
+
+    async def __call__(self, failure: Failure):
+        try:
+            if self.errback is None:
+                failure.raiseException()
+            output = self.errback(failure)
+            if inspect.isawaitable(output):
+                output = await output
+            if isinstance(output, Failure):
+                output.raiseException()
+            if hasattr(output, "__aiter__"):
+                output = [result async for result in output]
+            items = []
+            for result in arg_to_iter(output):
+                if isinstance(result, Request):
+                    self.crawler.engine.crawl(result)
+                else:
+                    items.append(result)
+            return items
+        finally:
+            self.crawler.signals.send_catch_log(request_processed, request=failure.request, spider=self.crawler.spider)
+
+
+class FrontierLeaseMiddleware:
+    """
+    Spider middleware ending the lease of a SharedScheduler request once its
+    callback is done. Requests the callback yields are scheduled here rather than
+    passed on, Scrapy works through callback output a few results at a time, so
+    the end of the output doesn't mean its last requests are in the frontier yet.
+    Keep it closest to the engine, below every other spider middleware.
+    """
+
+    def __init__(self, crawler):
+        self.crawler = crawler
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not uses_shared_frontier(crawler.settings):
+            raise NotConfigured("SCHEDULER is not a SharedScheduler")
+        return cls(crawler)
+
+    def _release(self, response, spider):
+        self.crawler.signals.send_catch_log(request_processed, request=response.request, spider=spider)
+
+    def process_spider_output(self, response, result, spider):
+        try:
+            for i in result:
+                if isinstance(i, Request):
+                    self.crawler.engine.crawl(i)
+                else:
+                    yield i
+        finally:
+            self._release(response, spider)
+
+    async def process_spider_output_async(self, response, result, spider):
+        try:
+            async for i in result:
+                if isinstance(i, Request):
+                    self.crawler.engine.crawl(i)
+                else:
+                    yield i
+        finally:
+            self._release(response, spider)
+
+    def process_spider_exception(self, response, exception, spider):
+        self._release(response, spider)
+        return None
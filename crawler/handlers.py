@@ -0,0 +1,63 @@
+# Download handlers used by the spiders.
+#
+# See documentation in:
+# https://docs.scrapy.org/en/latest/topics/download-handlers.html
+import inspect
+
+from scrapy_impersonate import ImpersonateDownloadHandler
+from scrapy_playwright.handler import ScrapyPlaywrightDownloadHandler
+from twisted.internet.defer import inlineCallbacks, maybeDeferred
+
+from crawler.blocking import ResourceBlocker
+
+
+# Scrapy 2.14 turned download_request()/close() into coroutines taking the request
+# alone; both wrapped handlers pick their convention from the same check.
+ASYNC_HANDLER_API = inspect.iscoroutinefunction(ImpersonateDownloadHandler.download_request)
+
+
+class FetchModeDownloadHandler:
+    """
+    Routes each request to a browser or to plain HTTP, so both fetch paths can
+    live in one crawl: requests with the `playwright` meta key go through
+    scrapy-playwright, everything else through scrapy-impersonate.
+
+    With RESOURCE_BLOCKING_ENABLED, browser sub-requests are filtered by a
+    crawler.blocking.ResourceBlocker instead of PLAYWRIGHT_ABORT_REQUEST, since
+    the blocker needs the crawler to record its stats.
+    """
+    lazy = False
+
+    def __init__(self, crawler):
+        self.browser_handler = ScrapyPlaywrightDownloadHandler.from_crawler(crawler)
+        if crawler.settings.getbool("RESOURCE_BLOCKING_ENABLED"):
+            self.browser_handler.abort_request = ResourceBlocker.from_crawler(crawler)
+        self.http_handler = ImpersonateDownloadHandler.from_crawler(crawler)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler)
+
+    def _handler_for(self, request):
+        if request.meta.get("playwright"):
+            return self.browser_handler
+        return self.http_handler
+
+    if ASYNC_HANDLER_API:
+
+        async def download_request(self, request):
+            return await self._handler_for(request).download_request(request)
+
+        async def close(self):
+            await self.browser_handler.close()
+            await self.http_handler.close()
+
+    else:
+
+        def download_request(self, request, spider):
+            return self._handler_for(request).download_request(request, spider)
+
+        @inlineCallbacks
+        def close(self):
+            yield maybeDeferred(self.browser_handler.close)
+            yield maybeDeferred(self.http_handler.close)
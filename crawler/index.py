@@ -0,0 +1,52 @@
+# On-disk index of auctions already scraped, used to make recurring crawls
+# incremental: ended auctions never change, so they are only fetched once.
+import os
+import sqlite3
+import time
+from typing import Iterable, Optional
+
+
+class AuctionIndex:
+    ENDED = 'ended'
+    LIVE = 'live'
+
+    def __init__(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS auctions ("
+            " url TEXT PRIMARY KEY,"
+            " vin TEXT,"
+            " status TEXT NOT NULL,"
+            " scraped_at REAL NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS auctions_vin ON auctions (vin)")
+        self.conn.commit()
+
+    def ended(self, urls: Iterable[str]) -> set:
+        """ subset of `urls` already scraped after the auction ended """
+        urls = list(urls)
+        if not urls:
+            return set()
+        placeholders = ",".join("?" * len(urls))
+        rows = self.conn.execute(
+            f"SELECT url FROM auctions WHERE status = ? AND url IN ({placeholders})",
+            [self.ENDED, *urls],
+        )
+        return {url for url, in rows}
+
+    def record(self, url: str, vin: Optional[str], status: str, scraped_at: Optional[float] = None):
+        self.conn.execute(
+            "INSERT INTO auctions (url, vin, status, scraped_at) VALUES (?, ?, ?, ?)"
+            " ON CONFLICT(url) DO UPDATE SET vin = excluded.vin, status = excluded.status,"
+            " scraped_at = excluded.scraped_at",
+            (url, vin, status, scraped_at or time.time()),
+        )
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
@@ -4,6 +4,8 @@
 # https://docs.scrapy.org/en/latest/topics/items.html
 
 import datetime
+from dataclasses import dataclass, field
+from typing import Optional
 
 import scrapy
 from itemloaders.processors import TakeFirst, MapCompose
@@ -50,3 +52,65 @@ class CarItem(scrapy.Item):
     reserve = scrapy.Field(output_processor=TakeFirst())
     scraped_date = scrapy.Field(output_processor=TakeFirst())
     source_page = scrapy.Field(output_processor=TakeFirst())
+    queries = scrapy.Field()
+
+
+@dataclass(slots=True)
+class Bid:
+    bidder: Optional[str]
+    amount: Optional[str]
+    timestamp: int
+
+
+@dataclass(slots=True)
+class CarRecord:
+    """
+    One auction as scraped, kept in slots rather than a per-item dict. Values are
+    the page's own text; price, mileage, counts, bid amounts and the end date are
+    turned into integers and dates a batch at a time on export, see
+    crawler.pipelines.normalize_tables.
+    """
+    source: str
+    year: Optional[str] = None
+    description: Optional[str] = None
+    price: Optional[str] = None
+    comment_count: Optional[str] = None
+    engine: Optional[str] = None
+    drivetrain: Optional[str] = None
+    mileage: Optional[str] = None
+    vin: Optional[str] = None
+    transmission: Optional[str] = None
+    exterior: Optional[str] = None
+    interior: Optional[str] = None
+    body_style: Optional[str] = None
+    model: Optional[str] = None
+    make: Optional[str] = None
+    location: Optional[str] = None
+    seller: Optional[str] = None
+    seller_type: Optional[str] = None
+    reserve: bool = True
+    auction_end_date: Optional[str] = None
+    bid_count: Optional[str] = None
+    comment_text: list = field(default_factory=list)
+    title_status: Optional[str] = None
+    bids: list = field(default_factory=list)
+    queries: list = field(default_factory=list)
+    source_page: Optional[str] = None
+
+
+@dataclass(slots=True)
+class AuctionDelta:
+    """
+    What changed on a live auction since the previous check, see the
+    carsandbids_watch spider. The first check of an auction reports everything
+    as new; later ones only come with a price, bid count or new bids changed.
+    """
+    source_page: str
+    observed_at: int
+    ended: bool
+    seconds_left: Optional[int] = None
+    price: Optional[str] = None
+    previous_price: Optional[str] = None
+    bid_count: Optional[str] = None
+    previous_bid_count: Optional[str] = None
+    new_bids: list = field(default_factory=list)
@@ -3,7 +3,22 @@
 # See documentation in:
 # https://docs.scrapy.org/en/latest/topics/spider-middleware.html
 
+import asyncio
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+from playwright.async_api import TimeoutError as PlaywrightTimeoutError
 from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from scrapy.http import TextResponse
+from scrapy_playwright.page import PageMethod
+from twisted.internet.error import TimeoutError as TwistedTimeoutError
+
+from crawler.signals import stage_timed
 
 # useful for handling different item types with a single interface
 from itemadapter import is_item, ItemAdapter
@@ -101,3 +116,350 @@ class CrawlerDownloaderMiddleware:
 
     def spider_opened(self, spider):
         spider.logger.info("Spider opened: %s" % spider.name)
+
+
+class PoolContext:
+    """ one browser context of the page pool and the pages it keeps warm """
+
+    def __init__(self, slot: int, generation: int):
+        self.name = f"pool-{slot}-{generation}"
+        self.slot = slot
+        self.generation = generation
+        self.idle = []
+        self.in_use = 0
+        self.navigations = 0
+        # failed downloads in a row
+        self.failures = 0
+        self.retired = False
+        # why it is to be retired, while an older generation of the slot is still open
+        self.retire_reason = None
+        # the Playwright BrowserContext, known once a page was opened in it
+        self.browser_context = None
+
+
+class PagePoolMiddleware:
+    """
+    Reuses Playwright pages across navigations instead of opening a fresh page for
+    every request and closing it in the callback.
+
+    Browser requests are spread over PAGE_POOL_CONTEXTS named contexts. When a
+    response comes back its page is detached from the request and kept idle for the
+    next request routed to the same context. A context is retired after
+    PAGE_POOL_CONTEXT_MAX_NAVIGATIONS navigations, after PAGE_POOL_CONTEXT_MAX_FAILURES
+    failed downloads in a row, or once a page reports a JS heap above
+    PAGE_POOL_CONTEXT_MAX_MEMORY_MB. New requests then go to a fresh context and the
+    old one is closed when its last page comes back. Requests are routed before
+    they wait for a download slot, so a retired context can have requests queued
+    for a while; a slot keeps at most one of those open, a context due to be
+    retired meanwhile stays in use until the older one is closed.
+    """
+
+    def __init__(self, crawler):
+        settings = crawler.settings
+        self.stats = crawler.stats
+        self.max_pages = settings.getint("PLAYWRIGHT_MAX_PAGES_PER_CONTEXT") or settings.getint("CONCURRENT_REQUESTS")
+        self.max_idle = settings.getint("PAGE_POOL_MAX_IDLE_PAGES", self.max_pages)
+        self.max_navigations = settings.getint("PAGE_POOL_CONTEXT_MAX_NAVIGATIONS", 0)
+        self.max_failures = settings.getint("PAGE_POOL_CONTEXT_MAX_FAILURES", 0)
+        self.max_memory = settings.getint("PAGE_POOL_CONTEXT_MAX_MEMORY_MB", 0) * 1024 * 1024
+        self.memory_check_interval = settings.getint("PAGE_POOL_MEMORY_CHECK_INTERVAL", 20)
+        self.contexts = [PoolContext(slot, 0) for slot in range(settings.getint("PAGE_POOL_CONTEXTS", 1))]
+        self.by_name = {context.name: context for context in self.contexts}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler)
+
+    def _pick_context(self) -> PoolContext:
+        # a warm page beats everything, then the context with the most room left
+        warm = [context for context in self.contexts if context.idle]
+        if warm:
+            return max(warm, key=lambda context: len(context.idle))
+        return min(self.contexts, key=lambda context: context.in_use)
+
+    async def _page_opened(self, page, request):
+        """ playwright_page_init_callback, keeps hold of the page and its context even if the navigation fails """
+        request.meta["playwright_page"] = page
+        context = self.by_name.get(request.meta.get("playwright_context"))
+        if context is not None:
+            context.browser_context = page.context
+
+    def process_request(self, request, spider):
+        if not request.meta.get("playwright"):
+            return None
+        # a retry is a copy that still names the pool context it was routed to,
+        # which may be retired or closed by now; route it again
+        if "playwright_context" in request.meta \
+                and request.meta["playwright_context"] != request.meta.get("page_pool_context"):
+            return None
+        context = self._pick_context()
+        request.meta["playwright_context"] = request.meta["page_pool_context"] = context.name
+        request.meta["playwright_include_page"] = True
+        request.meta["playwright_page_init_callback"] = self._page_opened
+        request.meta["page_pool"] = True
+        context.in_use += 1
+        context.navigations += 1
+        while context.idle:
+            page = context.idle.pop()
+            if not page.is_closed():
+                request.meta["playwright_page"] = page
+                self.stats.inc_value("page_pool/reused")
+                break
+        else:
+            self.stats.inc_value("page_pool/created")
+        if self.max_navigations and context.navigations >= self.max_navigations:
+            self._retire(context, "navigations")
+        return None
+
+    async def process_response(self, request, response, spider):
+        if request.meta.pop("page_pool", False):
+            request.meta.pop("playwright_page_init_callback", None)
+            context = self.by_name.get(request.meta.get("playwright_context"))
+            if context is not None:
+                context.failures = 0
+            await self._release(request, keep=True)
+        return response
+
+    async def process_exception(self, request, exception, spider):
+        # a page that failed mid-navigation is in an unknown state, don't reuse it
+        if request.meta.pop("page_pool", False):
+            request.meta.pop("playwright_page_init_callback", None)
+            context = self.by_name.get(request.meta.get("playwright_context"))
+            if context is not None:
+                context.failures += 1
+                if self.max_failures and context.failures >= self.max_failures:
+                    self._retire(context, "failures")
+            await self._release(request, keep=False)
+        return None
+
+    def _retire(self, context: PoolContext, reason: str):
+        if context.retired:
+            return
+        if any(other.retired and other.slot == context.slot for other in self.by_name.values()):
+            context.retire_reason = context.retire_reason or reason
+            return
+        context.retired = True
+        replacement = PoolContext(context.slot, context.generation + 1)
+        self.contexts[context.slot] = replacement
+        self.by_name[replacement.name] = replacement
+        self.stats.inc_value(f"page_pool/contexts_retired/{reason}")
+
+    async def _release(self, request, keep: bool):
+        page = request.meta.pop("playwright_page", None)
+        context = self.by_name.get(request.meta.get("playwright_context"))
+        if context is None:
+            return
+        context.in_use -= 1
+        if page is not None and not page.is_closed():
+            # handlers from playwright_page_event_handlers would pile up on a reused page
+            for event, handler in (request.meta.get("playwright_page_event_handlers") or {}).items():
+                if callable(handler):
+                    page.remove_listener(event, handler)
+            if keep and not context.retired and self.max_memory and context.navigations % self.memory_check_interval == 0:
+                heap = await page.evaluate("() => (performance.memory && performance.memory.usedJSHeapSize) || 0")
+                if heap > self.max_memory:
+                    self._retire(context, "memory")
+            # idle pages hold a slot of the context's page semaphore, never keep more
+            # than the requests already routed here leave free
+            if keep and not context.retired and len(context.idle) < self.max_idle \
+                    and context.in_use + len(context.idle) < self.max_pages:
+                context.idle.append(page)
+            else:
+                await page.close()
+        if context.retired and context.in_use == 0:
+            await self._close_context(context)
+
+    async def _close_context(self, context: PoolContext):
+        self.by_name.pop(context.name, None)
+        context.idle = []
+        # closes its pages too, and frees its slot of PLAYWRIGHT_MAX_CONTEXTS
+        if context.browser_context is not None:
+            await context.browser_context.close()
+            self.stats.inc_value("page_pool/contexts_closed")
+        current = self.contexts[context.slot]
+        if current.retire_reason is not None:
+            self._retire(current, current.retire_reason)
+            if current.in_use == 0:
+                await self._close_context(current)
+
+
+class HtmlArchiveMiddleware:
+    """
+    Stores every rendered HTML page so it can be parsed again later without a
+    browser, see crawler.replay.
+
+    Bodies are gzipped and content-addressed under HTML_ARCHIVE_DIR/objects, so a
+    page that didn't change between crawls is only stored once. HTML_ARCHIVE_DIR/
+    index.jsonl records which URL and callback each body belongs to.
+    """
+    # request meta worth keeping for a replay
+    archived_meta = ("query", "fetch_path")
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(os.path.join(directory, "objects"), exist_ok=True)
+        self.index = open(os.path.join(directory, "index.jsonl"), "a", encoding="utf-8", buffering=1)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        directory = crawler.settings.get("HTML_ARCHIVE_DIR")
+        if not directory:
+            raise NotConfigured("HTML_ARCHIVE_DIR is not set")
+        s = cls(directory)
+        s.stats = crawler.stats
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
+        return s
+
+    @staticmethod
+    def object_path(directory: str, digest: str) -> str:
+        return os.path.join(directory, "objects", digest[:2], f"{digest[2:]}.html.gz")
+
+    def _store(self, body: bytes) -> str:
+        digest = hashlib.sha256(body).hexdigest()
+        path = self.object_path(self.directory, digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # one temp file per call, identical bodies can be stored by several threads at once
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as raw, gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=6) as f:
+                    f.write(body)
+                os.replace(tmp_path, path)
+            except OSError:
+                # whoever got there first stored the same content
+                if not os.path.exists(path):
+                    raise
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+        return digest
+
+    async def process_response(self, request, response, spider):
+        callback = getattr(request.callback, "__name__", None)
+        if response.status != 200 or not isinstance(response, TextResponse) or callback is None:
+            return response
+        # compressing a few hundred KB is too slow for the reactor thread
+        digest = await asyncio.to_thread(self._store, response.body)
+        self.index.write(json.dumps({
+            "url": response.url,
+            "request_url": request.url,
+            "callback": callback,
+            "sha256": digest,
+            "encoding": response.encoding,
+            "meta": {key: request.meta[key] for key in self.archived_meta if key in request.meta},
+            "fetched_at": time.time(),
+        }) + "\n")
+        self.stats.inc_value("html_archive/stored")
+        return response
+
+    def spider_closed(self, spider):
+        self.index.close()
+
+
+def mark_stage(page, marks: list, stage: str):
+    marks.append((stage, time.monotonic()))
+
+
+class StageTimingMiddleware:
+    """
+    Times each stage of a download and reports it through the stage_timed signal:
+
+    - queue: from entering the downloader middleware to the download handler
+      starting on it, mostly time spent waiting for a free slot
+    - download: plain HTTP requests, handler to response
+    - navigation: browser requests, handler to the end of page.goto()
+    - one stage per page method, named after it (wait_for_selector,
+      scroll_until_stable, ...), measured by markers slipped in between them
+    - content: last page method to the response
+    - total: entering the downloader to the response
+
+    Download errors are counted per exception class, timeouts and requests
+    dropped before download on their own.
+    """
+    timeouts = (PlaywrightTimeoutError, TwistedTimeoutError, TimeoutError)
+
+    def __init__(self, crawler):
+        self.crawler = crawler
+        self.stats = crawler.stats
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        s = cls(crawler)
+        crawler.signals.connect(s.request_dropped, signal=signals.request_dropped)
+        return s
+
+    def process_request(self, request, spider):
+        marks = [("enqueued", time.monotonic())]
+        request.meta["stage_marks"] = marks
+        page_methods = request.meta.get("playwright_page_methods")
+        if request.meta.get("playwright") and isinstance(page_methods, (list, tuple)):
+            # drop markers left by an earlier attempt of the same request
+            page_methods = [pm for pm in page_methods if getattr(pm, "method", None) is not mark_stage]
+            instrumented = [PageMethod(mark_stage, marks, "navigation")]
+            for pm in page_methods:
+                name = pm.method if isinstance(pm.method, str) else getattr(pm.method, "__name__", "page_method")
+                instrumented += [pm, PageMethod(mark_stage, marks, name)]
+            request.meta["playwright_page_methods"] = instrumented
+        return None
+
+    def request_dropped(self, request, spider):
+        self.stats.inc_value("stage_timing/dropped")
+
+    def process_response(self, request, response, spider):
+        marks = request.meta.pop("stage_marks", None)
+        if not marks:
+            return response
+        now = time.monotonic()
+        last_stage = "content" if request.meta.get("playwright") else "download"
+        marks.append((last_stage, now))
+        # handlers report how long they worked on the request, what came before was waiting
+        latency = request.meta.get("download_latency")
+        if latency is not None:
+            marks.insert(1, ("queue", max(marks[0][1], now - latency)))
+        for (_, start), (stage, end) in zip(marks, marks[1:]):
+            self._send(stage, end - start, request, spider)
+        self._send("total", now - marks[0][1], request, spider)
+        return response
+
+    def process_exception(self, request, exception, spider):
+        request.meta.pop("stage_marks", None)
+        self.stats.inc_value(f"stage_timing/errors/{type(exception).__name__}")
+        if isinstance(exception, self.timeouts):
+            self.stats.inc_value("stage_timing/timeouts")
+        return None
+
+    def _send(self, stage, seconds, request, spider):
+        self.crawler.signals.send_catch_log(signal=stage_timed, stage=stage, seconds=seconds, request=request, spider=spider)
+
+
+class ParseTimingMiddleware:
+    """ times spider callbacks, from the response to the last request or item they produce """
+
+    def __init__(self, crawler):
+        self.crawler = crawler
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler)
+
+    def process_spider_input(self, response, spider):
+        response.meta["parse_started"] = time.monotonic()
+        return None
+
+    def _send(self, response, spider):
+        started = response.meta.pop("parse_started", None)
+        if started is not None:
+            self.crawler.signals.send_catch_log(
+                signal=stage_timed, stage="parse", seconds=time.monotonic() - started,
+                request=response.request, spider=spider,
+            )
+
+    def process_spider_output(self, response, result, spider):
+        for i in result:
+            yield i
+        self._send(response, spider)
+
+    async def process_spider_output_async(self, response, result, spider):
+        async for i in result:
+            yield i
+        self._send(response, spider)
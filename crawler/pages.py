@@ -0,0 +1,127 @@
+# Reusable Playwright page routines, meant to be passed to scrapy-playwright
+# as callables: PageMethod(scroll_until_stable, selector=...)
+#
+# See documentation in:
+# https://github.com/scrapy-plugins/scrapy-playwright#pagemethod-class
+import asyncio
+import re
+import time
+
+from playwright.async_api import Page, TimeoutError as PlaywrightTimeoutError
+
+
+class NetworkMonitor:
+    """ counts in-flight requests of a page while attached """
+
+    def __init__(self, page: Page):
+        self.page = page
+        self.in_flight = 0
+        self.last_activity = time.monotonic()
+
+    def _started(self, request):
+        self.in_flight += 1
+        self.last_activity = time.monotonic()
+
+    def _finished(self, request):
+        self.in_flight = max(0, self.in_flight - 1)
+        self.last_activity = time.monotonic()
+
+    def attach(self):
+        self.page.on("request", self._started)
+        self.page.on("requestfinished", self._finished)
+        self.page.on("requestfailed", self._finished)
+
+    def detach(self):
+        self.page.remove_listener("request", self._started)
+        self.page.remove_listener("requestfinished", self._finished)
+        self.page.remove_listener("requestfailed", self._finished)
+
+    async def wait_for_idle(self, idle_time: float):
+        """ returns once nothing has been in flight for `idle_time` seconds """
+        while True:
+            quiet_for = time.monotonic() - self.last_activity
+            if self.in_flight == 0 and quiet_for >= idle_time:
+                return
+            await asyncio.sleep(max(0.05, idle_time - quiet_for) if self.in_flight == 0 else 0.05)
+
+
+async def scroll_until_stable(page: Page, selector: str, max_rounds: int = 20, settle_timeout: int = 3000,
+                              idle_time: int = 500, max_time: int = 60000) -> int:
+    """
+    Scroll to the bottom until the number of elements matching the CSS `selector`
+    stops growing, and return that number.
+
+    After each scroll the routine moves on as soon as new elements show up. A round
+    that adds nothing before the network goes idle for `idle_time` ms, or before
+    `settle_timeout` ms pass, ends the loop. `max_rounds` and `max_time` (ms) cap
+    the total work on endless lists.
+    """
+    deadline = time.monotonic() + max_time / 1000
+    monitor = NetworkMonitor(page)
+    monitor.attach()
+    try:
+        count = await page.locator(selector).count()
+        for _ in range(max_rounds):
+            # the scroll itself counts as activity, lazy loaders need a moment to fire
+            monitor.last_activity = time.monotonic()
+            await page.evaluate("window.scrollTo(0, document.body.scrollHeight);")
+            grown = asyncio.ensure_future(page.wait_for_function(
+                "([selector, count]) => document.querySelectorAll(selector).length > count",
+                arg=[selector, count],
+                timeout=settle_timeout,
+            ))
+            idle = asyncio.ensure_future(monitor.wait_for_idle(idle_time / 1000))
+            done, pending = await asyncio.wait({grown, idle}, return_when=asyncio.FIRST_COMPLETED)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+            error = grown.exception() if grown in done else None
+            if error and not isinstance(error, PlaywrightTimeoutError):
+                raise error
+
+            new_count = await page.locator(selector).count()
+            if new_count <= count or time.monotonic() >= deadline:
+                count = max(count, new_count)
+                break
+            count = new_count
+        return count
+    finally:
+        monitor.detach()
+
+
+class JsonCapture:
+    """
+    Keeps the JSON bodies of the XHR/fetch responses a page receives from URLs
+    matching `url_pattern`. Register `on_response` for the page's "response" event
+    before navigating, then pass `wait_for_responses` as the last PageMethod so
+    bodies still being read are in `payloads` before the page content is taken.
+    """
+    resource_types = ("xhr", "fetch")
+
+    def __init__(self, url_pattern: str):
+        self.url_pattern = re.compile(url_pattern)
+        self.payloads = []
+        self.failed = 0
+        self.pending = set()
+
+    def on_response(self, response):
+        if response.request.resource_type not in self.resource_types or not self.url_pattern.search(response.url):
+            return
+        task = asyncio.ensure_future(self._read(response))
+        self.pending.add(task)
+        task.add_done_callback(self.pending.discard)
+
+    async def _read(self, response):
+        try:
+            self.payloads.append(await response.json())
+        except Exception:
+            # redirects, empty and non-JSON bodies, or the page went away first
+            self.failed += 1
+
+    async def wait_for_responses(self, page: Page, timeout: int = 5000) -> int:
+        """ waits up to `timeout` ms for bodies still being read, returns how many were captured """
+        if self.pending:
+            _, pending = await asyncio.wait(set(self.pending), timeout=timeout / 1000)
+            for task in pending:
+                task.cancel()
+        return len(self.payloads)
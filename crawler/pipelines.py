@@ -2,12 +2,317 @@
 #
 # Don't forget to add your pipeline to the ITEM_PIPELINES setting
 # See: https://docs.scrapy.org/en/latest/topics/item-pipeline.html
-
+import datetime
+import gzip
+import json
+import logging
+import os
+import queue
+import re
+import threading
+import time
+from dataclasses import is_dataclass
 
 # useful for handling different item types with a single interface
 from itemadapter import ItemAdapter
+from twisted.internet.threads import deferToThread
+
+from crawler.frontier import uses_shared_frontier, worker_id
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pc = pq = None
+
+
+logger = logging.getLogger(__name__)
 
 
 class CrawlerPipeline:
     def process_item(self, item, spider):
         return item
+
+
+AUCTION_FIELDS = (
+    'source', 'year', 'description', 'price', 'comment_count', 'engine', 'drivetrain', 'mileage', 'vin',
+    'transmission', 'exterior', 'interior', 'body_style', 'model', 'make', 'location', 'seller', 'seller_type',
+    'reserve', 'auction_end_date', 'bid_count', 'title_status', 'queries', 'source_page',
+)
+BID_FIELDS = ('source_page', 'position', 'bidder', 'amount', 'timestamp')
+COMMENT_FIELDS = ('source_page', 'position', 'text')
+# text columns holding a number, e.g. "$45,500", "12,300 Miles" or "31"
+INTEGER_FIELDS = {
+    'auctions': ('year', 'price', 'comment_count', 'mileage', 'bid_count'),
+    'bids': ('amount',),
+}
+# text columns holding a date, in the spider's convert_date_string format
+DATE_FIELDS = {'auctions': ('auction_end_date',)}
+DATE_FORMAT = '%m/%d/%Y'
+# cents, then everything that isn't a digit
+NOT_DIGITS = (r'\.\d*', r'\D')
+
+
+def _get(obj, field: str):
+    """ field of a dict or a dataclass record such as CarRecord and Bid """
+    return obj.get(field) if isinstance(obj, dict) else getattr(obj, field, None)
+
+
+def split_tables(items: list) -> dict:
+    """ nested car items -> flat auction, bid and comment rows, column by column """
+    auctions = {field: [] for field in AUCTION_FIELDS}
+    bids = {field: [] for field in BID_FIELDS}
+    comments = {field: [] for field in COMMENT_FIELDS}
+    for item in items:
+        for field in AUCTION_FIELDS:
+            auctions[field].append(_get(item, field))
+        source_page = _get(item, 'source_page')
+        for position, bid in enumerate(_get(item, 'bids') or ()):
+            bids['source_page'].append(source_page)
+            bids['position'].append(position)
+            bids['bidder'].append(_get(bid, 'bidder'))
+            bids['amount'].append(_get(bid, 'amount'))
+            bids['timestamp'].append(_get(bid, 'timestamp'))
+        for position, text in enumerate(_get(item, 'comment_text') or ()):
+            comments['source_page'].append(source_page)
+            comments['position'].append(position)
+            comments['text'].append(text)
+    return {'auctions': auctions, 'bids': bids, 'comments': comments}
+
+
+def _integers(values: list):
+    if pc is None:
+        integers = []
+        for value in values:
+            if isinstance(value, str):
+                value = re.sub(NOT_DIGITS[1], '', re.sub(NOT_DIGITS[0], '', value))
+                value = int(value) if value else None
+            integers.append(value)
+        return integers
+    digits = pa.array(values, pa.string())
+    for pattern in NOT_DIGITS:
+        digits = pc.replace_substring_regex(digits, pattern, '')
+    # no digits at all, e.g. "TMU" mileage, is a missing value rather than 0
+    digits = pc.if_else(pc.equal(digits, ''), pa.scalar(None, pa.string()), digits)
+    return pc.cast(digits, pa.int64())
+
+
+def _dates(values: list):
+    if pc is None:
+        dates = []
+        for value in values:
+            try:
+                dates.append(datetime.datetime.strptime(value, DATE_FORMAT).date())
+            except (TypeError, ValueError):
+                dates.append(None)
+        return dates
+    timestamps = pc.strptime(pa.array(values, pa.string()), format=DATE_FORMAT, unit='s', error_is_null=True)
+    return pc.cast(timestamps, pa.date32())
+
+
+def normalize_tables(tables: dict) -> dict:
+    """
+    Number and date text columns of split_tables() output -> integers and dates,
+    a whole column per call. With pyarrow the columns become arrow arrays, handled
+    by pyarrow.compute kernels instead of one Python call per value.
+    """
+    for table, fields in INTEGER_FIELDS.items():
+        for field in fields:
+            tables[table][field] = _integers(tables[table][field])
+    for table, fields in DATE_FIELDS.items():
+        for field in fields:
+            tables[table][field] = _dates(tables[table][field])
+    return tables
+
+
+def table_schemas() -> dict:
+    string_fields = lambda fields: [(field, pa.string()) for field in fields]
+    auction_types = dict(string_fields(AUCTION_FIELDS), reserve=pa.bool_(), queries=pa.list_(pa.string()))
+    auction_types.update({field: pa.int64() for field in INTEGER_FIELDS['auctions']})
+    auction_types.update({field: pa.date32() for field in DATE_FIELDS['auctions']})
+    return {
+        'auctions': pa.schema([(field, auction_types[field]) for field in AUCTION_FIELDS]),
+        'bids': pa.schema([
+            ('source_page', pa.string()), ('position', pa.int32()), ('bidder', pa.string()),
+            ('amount', pa.int64()), ('timestamp', pa.int64()),
+        ]),
+        'comments': pa.schema([('source_page', pa.string()), ('position', pa.int32()), ('text', pa.string())]),
+    }
+
+
+class RollingFile:
+    """ parts of one table, a new part is started once the current one reaches `max_bytes` """
+
+    def __init__(self, directory: str, extension: str, max_bytes: int):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.extension = extension
+        self.max_bytes = max_bytes
+        self.part = -1
+        self.path = None
+
+    def next_path(self) -> str:
+        self.part += 1
+        self.path = os.path.join(self.directory, f"part-{self.part:05d}.{self.extension}")
+        return self.path
+
+    def full(self) -> bool:
+        return self.max_bytes > 0 and os.path.getsize(self.path) >= self.max_bytes
+
+
+class JsonLinesTableWriter(RollingFile):
+
+    def __init__(self, directory: str, max_bytes: int, compresslevel: int = 6):
+        super().__init__(directory, 'jsonl.gz', max_bytes)
+        self.compresslevel = compresslevel
+        self.file = None
+
+    def write(self, columns: dict):
+        if self.file is None:
+            self.file = gzip.open(self.next_path(), 'wt', encoding='utf-8', compresslevel=self.compresslevel)
+        names = list(columns)
+        values = [column.to_pylist() if hasattr(column, 'to_pylist') else column for column in columns.values()]
+        for row in zip(*values):
+            self.file.write(json.dumps(dict(zip(names, row)), ensure_ascii=False, default=str))
+            self.file.write('\n')
+        self.file.flush()
+        if self.full():
+            self.close()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+class ParquetTableWriter(RollingFile):
+
+    def __init__(self, directory: str, max_bytes: int, schema, compression: str = 'zstd'):
+        super().__init__(directory, 'parquet', max_bytes)
+        self.schema = schema
+        self.compression = compression
+        self.writer = None
+
+    def write(self, columns: dict):
+        if self.writer is None:
+            self.writer = pq.ParquetWriter(self.next_path(), self.schema, compression=self.compression)
+        self.writer.write_table(pa.table(columns, schema=self.schema))
+        if self.full():
+            self.close()
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+
+class ColumnarExportPipeline:
+    """
+    Writes car items as three flat tables, auctions, bids and comments, joined on
+    `source_page`: zstd-compressed Parquet when pyarrow is installed, gzipped JSON
+    lines otherwise. Prices, mileage, counts and bid amounts are written as
+    integers and the auction end date as a date, see normalize_tables.
+
+    Items are grouped in batches of EXPORT_BATCH_SIZE and written by a background
+    thread. At most EXPORT_MAX_PENDING_BATCHES batches are queued, so memory stays
+    bounded when the disk is slower than the crawl: a full batch that doesn't fit
+    is handed over from a thread pool, and its item is held back until it does.
+    Each table rolls over to a new part file once the current one reaches
+    EXPORT_ROLLOVER_BYTES.
+    """
+
+    def __init__(self, directory: str, export_format: str, batch_size: int, max_pending: int, rollover_bytes: int,
+                 worker: str = None):
+        if export_format == 'parquet' and pa is None:
+            logger.warning("pyarrow is not installed, exporting compressed JSON lines instead of Parquet")
+            export_format = 'jsonl'
+        if export_format not in ('parquet', 'jsonl'):
+            raise ValueError(f"EXPORT_FORMAT must be 'parquet' or 'jsonl', got {export_format!r}")
+        self.directory = directory
+        self.export_format = export_format
+        self.batch_size = batch_size
+        self.rollover_bytes = rollover_bytes
+        self.worker = worker
+        self.batch = []
+        self.batches = queue.Queue(maxsize=max_pending)
+        self.writers = {}
+        self.error = None
+        self.thread = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        return cls(
+            directory=settings.get("EXPORT_DIR", "exports"),
+            export_format=settings.get("EXPORT_FORMAT", "parquet"),
+            batch_size=settings.getint("EXPORT_BATCH_SIZE", 500),
+            max_pending=settings.getint("EXPORT_MAX_PENDING_BATCHES", 4),
+            rollover_bytes=settings.getint("EXPORT_ROLLOVER_BYTES", 256*1024*1024),
+            # workers of a shared-frontier crawl started in the same second would share a run directory
+            worker=worker_id() if uses_shared_frontier(settings) else None,
+        )
+
+    def open_spider(self, spider):
+        run = time.strftime('%Y%m%dT%H%M%S') + (f"-{self.worker}" if self.worker else "")
+        run_directory = os.path.join(self.directory, spider.name, run)
+        schemas = table_schemas() if self.export_format == 'parquet' else {}
+        for table in ('auctions', 'bids', 'comments'):
+            table_directory = os.path.join(run_directory, table)
+            if self.export_format == 'parquet':
+                self.writers[table] = ParquetTableWriter(table_directory, self.rollover_bytes, schemas[table])
+            else:
+                self.writers[table] = JsonLinesTableWriter(table_directory, self.rollover_bytes)
+        self.thread = threading.Thread(target=self._write_batches, name="export-writer", daemon=True)
+        self.thread.start()
+        spider.logger.info(f"Exporting {self.export_format} tables to {run_directory}")
+
+    def process_item(self, item, spider):
+        if self.error is not None:
+            # already logged by the writer thread, the crawl itself goes on
+            return item
+        # split_tables reads dicts and dataclass records (CarRecord) field by field,
+        # converting those here would only copy every item
+        self.batch.append(item if isinstance(item, dict) or is_dataclass(item) else ItemAdapter(item).asdict())
+        if len(self.batch) >= self.batch_size:
+            batch, self.batch = self.batch, []
+            try:
+                self.batches.put_nowait(batch)
+            except queue.Full:
+                # the writer is behind: wait off the reactor, Scrapy holds the item
+                # (and with CONCURRENT_ITEMS, the response it came from) until then
+                return deferToThread(self.batches.put, batch).addCallback(lambda _: item)
+        return item
+
+    def close_spider(self, spider):
+        return deferToThread(self._finish).addCallback(lambda _: self._report(spider))
+
+    def _finish(self):
+        if self.batch:
+            self.batches.put(self.batch)
+            self.batch = []
+        self.batches.put(None)
+        self.thread.join()
+
+    def _report(self, spider):
+        if self.error is not None:
+            spider.logger.error(f"Export failed: {self.error!r}")
+
+    def _write_batches(self):
+        try:
+            while True:
+                batch = self.batches.get()
+                if batch is None:
+                    break
+                for table, columns in normalize_tables(split_tables(batch)).items():
+                    if columns and len(columns[next(iter(columns))]):
+                        self.writers[table].write(columns)
+        except Exception as e:
+            self.error = e
+            logger.exception("Export writer stopped")
+            # keep draining so process_item never blocks on a dead writer
+            while self.batches.get() is not None:
+                pass
+        finally:
+            for writer in self.writers.values():
+                writer.close()
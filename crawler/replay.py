@@ -0,0 +1,125 @@
+"""
+Re-parse pages stored by HtmlArchiveMiddleware, with no browser and no network.
+
+    python -m crawler.replay archive/ -o items.jsonl -j 8
+
+Every archived page is fed back through the spider callback that handled it
+originally, in a pool of worker processes. Items are written as JSON lines;
+requests the callbacks yield (pagination, auction pages) are dropped.
+"""
+import argparse
+import asyncio
+import gzip
+import json
+import multiprocessing
+import os
+import sys
+
+from itemadapter import ItemAdapter, is_item
+from scrapy.crawler import Crawler
+from scrapy.http import HtmlResponse, Request
+from scrapy.utils.misc import load_object
+from scrapy.utils.project import get_project_settings
+
+from crawler.middlewares import HtmlArchiveMiddleware
+from crawler.spiders.carsandbids import Carsandbids
+
+
+def offline_spider(spidercls=Carsandbids, settings: dict = None, **spider_kwargs):
+    """ spider instance whose callbacks can be called directly, outside of a crawl """
+    project_settings = get_project_settings()
+    # re-parsing must neither skip nor record auctions
+    project_settings.set("CARSANDBIDS_INDEX_PATH", None)
+    project_settings.setdict(settings or {})
+    crawler = Crawler(spidercls, project_settings)
+    crawler.stats = load_object(crawler.settings["STATS_CLASS"])(crawler)
+    return spidercls.from_crawler(crawler, **spider_kwargs)
+
+
+def read_index(directory: str, latest: bool = True) -> list:
+    with open(os.path.join(directory, "index.jsonl"), encoding="utf-8") as f:
+        entries = [json.loads(line) for line in f if line.strip()]
+    if latest:
+        # the index is append-only, a later entry for the same URL supersedes earlier ones
+        entries = list({entry["request_url"]: entry for entry in entries}.values())
+    return entries
+
+
+def archived_response(directory: str, entry: dict) -> HtmlResponse:
+    with gzip.open(HtmlArchiveMiddleware.object_path(directory, entry["sha256"]), "rb") as f:
+        body = f.read()
+    request = Request(entry["request_url"], meta=dict(entry.get("meta") or {}))
+    return HtmlResponse(url=entry["url"], body=body, encoding=entry.get("encoding") or "utf-8", request=request)
+
+
+async def collect(result) -> list:
+    """ items out of whatever a callback returned: a coroutine, an async or a plain iterable """
+    if asyncio.iscoroutine(result):
+        result = await result
+    if result is None:
+        return []
+    if hasattr(result, "__aiter__"):
+        output = [obj async for obj in result]
+    elif isinstance(result, Request) or is_item(result):
+        output = [result]
+    else:
+        output = list(result)
+    return [obj for obj in output if not isinstance(obj, Request)]
+
+
+def run_callback(spider, response: HtmlResponse, callback: str, loop=None) -> list:
+    loop = loop or asyncio.get_event_loop()
+    return loop.run_until_complete(collect(getattr(spider, callback)(response)))
+
+
+_worker = {}
+
+
+def _init_worker(directory: str):
+    _worker["directory"] = directory
+    _worker["spider"] = offline_spider()
+    _worker["loop"] = asyncio.new_event_loop()
+
+
+def _replay_entry(entry: dict) -> list:
+    try:
+        response = archived_response(_worker["directory"], entry)
+        return run_callback(_worker["spider"], response, entry["callback"], _worker["loop"])
+    except Exception as e:
+        print(f"Failed to re-parse {entry['request_url']}: {e!r}", file=sys.stderr)
+        return []
+
+
+def replay(directory: str, output, jobs: int = None, callbacks: tuple = ("parse_car",), latest: bool = True) -> int:
+    entries = [entry for entry in read_index(directory, latest) if entry["callback"] in callbacks]
+    count = 0
+    with multiprocessing.Pool(jobs, initializer=_init_worker, initargs=(directory,)) as pool:
+        for items in pool.imap(_replay_entry, entries, chunksize=8):
+            for item in items:
+                output.write(json.dumps(ItemAdapter(item).asdict(), ensure_ascii=False, default=str) + "\n")
+                count += 1
+    return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("archive", help="HTML_ARCHIVE_DIR of the crawl(s) to re-parse")
+    parser.add_argument("-o", "--output", help="JSON lines file for the items, stdout by default")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(), help="worker processes")
+    parser.add_argument("-c", "--callback", action="append", dest="callbacks",
+                        help="only replay pages of this callback (default: parse_car), repeatable")
+    parser.add_argument("--all-versions", action="store_true",
+                        help="replay every archived copy of a URL, not just the latest")
+    args = parser.parse_args(argv)
+
+    output = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+    try:
+        count = replay(args.archive, output, args.jobs, tuple(args.callbacks or ("parse_car",)), not args.all_versions)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    print(f"Re-parsed {count} items", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+# Failure handling shared by the spiders: which kind of failure a request hit,
+# how many retries each kind gets, and where requests go once they ran out.
+import json
+import os
+import time
+from typing import Optional
+
+from playwright.async_api import Error as PlaywrightError, TimeoutError as PlaywrightTimeoutError
+from scrapy.exceptions import IgnoreRequest
+from scrapy.spidermiddlewares.httperror import HttpError
+from twisted.internet.defer import TimeoutError as DeferredTimeoutError
+from twisted.internet.error import TimeoutError as ConnectionTimeoutError
+from twisted.python.failure import Failure
+
+
+# retries per failure class, on top of the first attempt
+RETRY_BUDGET = {
+    'timeout': 2,   # a selector or navigation didn't show up in time
+    'browser': 2,   # the page or browser broke, e.g. target closed
+    'server': 2,    # 5xx or 429 left over after RetryMiddleware
+    'network': 1,   # DNS, connection refused or reset, TLS
+    'client': 0,    # other 4xx, or a request dropped on purpose
+}
+
+
+def failure_class(failure: Failure) -> str:
+    """ RETRY_BUDGET key for the error behind an errback call """
+    error = failure.value
+    if isinstance(error, (PlaywrightTimeoutError, DeferredTimeoutError, ConnectionTimeoutError, TimeoutError)):
+        return 'timeout'
+    if isinstance(error, PlaywrightError):
+        return 'browser'
+    if isinstance(error, HttpError):
+        status = error.response.status
+        return 'server' if status >= 500 or status == 429 else 'client'
+    if isinstance(error, IgnoreRequest):
+        return 'client'
+    return 'network'
+
+
+def attempt_value(values: list, attempt: int):
+    """ value for the given 0-based attempt, the last one repeats once the list runs out """
+    return values[min(attempt, len(values) - 1)]
+
+
+class DeadLetters:
+    """
+    JSON lines file of requests that still failed after their retries, with what
+    is needed to issue them again in a later run.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.file = None
+
+    def write(self, url: str, callback: str, failure: str, error: str, attempts: int, **extra):
+        if self.file is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self.file = open(self.path, "a", encoding="utf-8", buffering=1)
+        entry = dict(url=url, callback=callback, failure=failure, error=error, attempts=attempts,
+                     failed_at=time.time(), **extra)
+        self.file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+    @staticmethod
+    def read(path: str) -> list:
+        """ entries of a dead-letter file, the last one per URL and callback """
+        with open(path, encoding="utf-8") as f:
+            entries = [json.loads(line) for line in f if line.strip()]
+        return list({(entry["url"], entry["callback"]): entry for entry in entries}.values())
+
+    def take(self, path: Optional[str] = None) -> list:
+        """
+        read() and move the file aside, so the run replaying it starts a fresh one
+        for whatever fails again
+        """
+        path = path or self.path
+        entries = self.read(path)
+        if os.path.abspath(path) == os.path.abspath(self.path):
+            self.close()
+            os.replace(path, f"{path}.{time.strftime('%Y%m%dT%H%M%S')}")
+        return entries
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
@@ -6,8 +6,6 @@
 #     https://docs.scrapy.org/en/latest/topics/settings.html
 #     https://docs.scrapy.org/en/latest/topics/downloader-middleware.html
 #     https://docs.scrapy.org/en/latest/topics/spider-middleware.html
-from urllib.parse import urlparse
-
 
 BOT_NAME = "crawler"
 
@@ -22,7 +20,8 @@ USER_AGENT = None
 ROBOTSTXT_OBEY = False
 
 # Configure maximum concurrent requests performed by Scrapy (default: 16)
-CONCURRENT_REQUESTS = 8
+# Browser pages are limited further by AdaptiveConcurrency, see below.
+CONCURRENT_REQUESTS = 16
 
 # Configure a delay for requests for the same website (default: 0)
 # See https://docs.scrapy.org/en/latest/topics/settings.html#download-delay
@@ -46,27 +45,54 @@ COOKIES_ENABLED = False
 
 # Enable or disable spider middlewares
 # See https://docs.scrapy.org/en/latest/topics/spider-middleware.html
-#SPIDER_MIDDLEWARES = {
+SPIDER_MIDDLEWARES = {
+    # only active with the shared frontier scheduler, must stay below every other
+    "crawler.frontier.FrontierLeaseMiddleware": 10,
 #    "crawler.middlewares.CrawlerSpiderMiddleware": 543,
-#}
+    "crawler.middlewares.ParseTimingMiddleware": 1000,
+}
 
 # Enable or disable downloader middlewares
 # See https://docs.scrapy.org/en/latest/topics/downloader-middleware.html
-#DOWNLOADER_MIDDLEWARES = {
+DOWNLOADER_MIDDLEWARES = {
 #    "crawler.middlewares.CrawlerDownloaderMiddleware": 543,
-#}
+    "crawler.middlewares.HtmlArchiveMiddleware": 960,
+    "crawler.middlewares.PagePoolMiddleware": 950,
+    "crawler.middlewares.StageTimingMiddleware": 970,
+}
+
+# Rendered pages are archived here for offline re-parsing with
+# `python -m crawler.replay`. Set to None to disable.
+HTML_ARCHIVE_DIR = "archive"
 
 # Enable or disable extensions
 # See https://docs.scrapy.org/en/latest/topics/extensions.html
-#EXTENSIONS = {
+EXTENSIONS = {
 #    "scrapy.extensions.telnet.TelnetConsole": None,
-#}
+    "crawler.extensions.StageMetrics": 500,
+    "crawler.extensions.AdaptiveConcurrency": 510,
+}
+
+# Per-stage latency histograms in the Prometheus text format
+# (see crawler.extensions.StageMetrics). Set to None to disable. With the shared
+# frontier each worker writes its own, named after its worker id.
+METRICS_FILE = "metrics/crawler.prom"
+METRICS_EXPORT_INTERVAL = 15
 
 # Configure item pipelines
 # See https://docs.scrapy.org/en/latest/topics/item-pipeline.html
-#ITEM_PIPELINES = {
+ITEM_PIPELINES = {
 #    "crawler.pipelines.CrawlerPipeline": 300,
-#}
+    "crawler.pipelines.ColumnarExportPipeline": 800,
+}
+
+# Columnar export (see crawler.pipelines.ColumnarExportPipeline), one run directory
+# per crawl, and per worker with the shared frontier
+EXPORT_DIR = "exports"
+EXPORT_FORMAT = "parquet"
+EXPORT_BATCH_SIZE = 500
+EXPORT_MAX_PENDING_BATCHES = 4
+EXPORT_ROLLOVER_BYTES = 256*1024*1024
 
 # Enable and configure the AutoThrottle extension (disabled by default)
 # See https://docs.scrapy.org/en/latest/topics/autothrottle.html
@@ -81,6 +107,22 @@ COOKIES_ENABLED = False
 # Enable showing throttling stats for every response received:
 #AUTOTHROTTLE_DEBUG = False
 
+# Adaptive number of browser pages in flight (see crawler.extensions.AdaptiveConcurrency)
+ADAPTIVE_CONCURRENCY_ENABLED = True
+ADAPTIVE_CONCURRENCY_SLOT = "browser"
+ADAPTIVE_CONCURRENCY_MIN = 2
+ADAPTIVE_CONCURRENCY_MAX = 16
+ADAPTIVE_CONCURRENCY_START = 8
+ADAPTIVE_CONCURRENCY_INTERVAL = 10
+ADAPTIVE_CONCURRENCY_TARGET_LATENCY = 15
+ADAPTIVE_CONCURRENCY_MAX_ERROR_RATE = 0.1
+ADAPTIVE_CONCURRENCY_BACKOFF = 0.7
+#ADAPTIVE_CONCURRENCY_HEALTH_URL = "http://localhost:3000/pressure?token=6R0W53R135510"
+#ADAPTIVE_CONCURRENCY_DEBUG = False
+DOWNLOAD_SLOTS = {
+    "browser": {"concurrency": ADAPTIVE_CONCURRENCY_START, "delay": 0},
+}
+
 # Enable and configure HTTP caching (disabled by default)
 # See https://docs.scrapy.org/en/latest/topics/downloader-middleware.html#httpcache-middleware-settings
 #HTTPCACHE_ENABLED = True
@@ -95,18 +137,68 @@ TWISTED_REACTOR = "twisted.internet.asyncioreactor.AsyncioSelectorReactor"
 FEED_EXPORT_ENCODING = "utf-8"
 
 
-def should_abort_request(request):
-    allowed_str = ['carsandbids']
-    if request.resource_type == "image" or ".jpg" in request.url:
-        return True
-    for string in allowed_str:
-        domain = urlparse(request.url).netloc.lower()
-        if not string in domain:
-            return True
-
-PLAYWRIGHT_MAX_CONTEXTS = 1
-PLAYWRIGHT_ABORT_REQUEST = should_abort_request
+# Browser sub-requests to abort (see crawler.blocking.ResourceBlocker), the
+# defaults there block media, fonts, CSS, trackers and anything off carsandbids.com
+RESOURCE_BLOCKING_ENABLED = True
+#RESOURCE_BLOCKING_RESOURCE_TYPES = ["image", "media", "font", "stylesheet", "texttrack", "manifest"]
+#RESOURCE_BLOCKING_ALLOWED_DOMAINS = ["carsandbids.com"]
+#RESOURCE_BLOCKING_DENIED_DOMAINS = ["google-analytics.com", "googletagmanager.com"]
+#RESOURCE_BLOCKING_URL_PATTERNS = [r"\.(?:jpe?g|png|gif|webp)(?:[?#]|$)"]
+#RESOURCE_BLOCKING_ESTIMATED_BYTES = {"image": 120000}
+
+# Page pool (see crawler.middlewares.PagePoolMiddleware). Retired contexts stay
+# open until their last page returns, hence room for two per pool slot.
+PAGE_POOL_CONTEXTS = 2
+PAGE_POOL_MAX_IDLE_PAGES = 4
+PAGE_POOL_CONTEXT_MAX_NAVIGATIONS = 200
+PAGE_POOL_CONTEXT_MAX_FAILURES = 3
+PAGE_POOL_CONTEXT_MAX_MEMORY_MB = 0
+PAGE_POOL_MEMORY_CHECK_INTERVAL = 20
+
+PLAYWRIGHT_MAX_CONTEXTS = 2*PAGE_POOL_CONTEXTS
 PLAYWRIGHT_BROWSER_TYPE = "firefox"
 PLAYWRIGHT_MAX_PAGES_PER_CONTEXT = 8
 PLAYWRIGHT_DEFAULT_NAVIGATION_TIMEOUT = 60*1000
 PLAYWRIGHT_CONNECT_URL = 'ws://localhost:3000/playwright/firefox?token=6R0W53R135510&timeout=0'
+
+# Infinite-scroll loading of search result pages (see crawler.pages.scroll_until_stable)
+CARSANDBIDS_SCROLL_MAX_ROUNDS = 20
+CARSANDBIDS_SCROLL_SETTLE_TIMEOUT = 3*1000
+CARSANDBIDS_SCROLL_IDLE_TIME = 500
+CARSANDBIDS_SCROLL_MAX_TIME = 60*1000
+
+# Timeouts per attempt of browser requests, the last one repeats for later attempts
+CARSANDBIDS_SELECTOR_TIMEOUTS = [10*1000, 25*1000, 60*1000]
+CARSANDBIDS_NAVIGATION_TIMEOUTS = [30*1000, 60*1000]
+# Retries per failure class (see crawler.retry.RETRY_BUDGET for the classes); requests
+# that exhaust theirs are appended to the dead-letter file, replay it with
+# `scrapy crawl carsandbids -a dead_letters=state/dead_letters.jsonl`
+CARSANDBIDS_RETRY_BUDGET = {"timeout": 2, "browser": 2, "server": 2, "network": 1, "client": 0}
+CARSANDBIDS_DEAD_LETTER_PATH = "state/dead_letters.jsonl"
+
+# Bids and comments of rendered auction pages come from the page's own JSON API
+# responses when these are captured, the DOM is only read when nothing was
+CARSANDBIDS_NETWORK_CAPTURE = True
+CARSANDBIDS_CAPTURE_URL_PATTERN = r"carsandbids\.com/v2/autos/auctions/"
+CARSANDBIDS_CAPTURE_WAIT = 5*1000
+
+# Shared frontier (see crawler.frontier): run the same crawl command in several
+# processes with SCHEDULER set to crawler.frontier.SharedScheduler and they split
+# the work. The SQLite backend only works for workers on one machine.
+#SCHEDULER = "crawler.frontier.SharedScheduler"
+FRONTIER_BACKEND = "crawler.frontier.SqliteFrontier"
+FRONTIER_PATH = "state/frontier.sqlite"
+# Workers with the same crawl name share a queue and seen-set; None means the
+# spider name plus the start day. A drained crawl is reset when its workers close.
+FRONTIER_CRAWL = None
+FRONTIER_LEASE_TIMEOUT = 600
+
+# Live-auction watch (carsandbids_watch spider): [seconds left up to, refresh every]
+# pairs, the refresh period past the last one, and how often searches run again
+WATCH_REFRESH_SCHEDULE = [[2*60, 10], [15*60, 30], [60*60, 2*60], [24*60*60, 15*60]]
+WATCH_REFRESH_DEFAULT = 60*60
+WATCH_DISCOVERY_INTERVAL = 30*60
+
+# Index of scraped auctions; ended ones are skipped on later runs unless the
+# spider is started with -a full_refresh=1. Set to None to disable.
+CARSANDBIDS_INDEX_PATH = "state/auctions.sqlite"
@@ -0,0 +1,12 @@
+# Signals sent by the project's own components, in addition to scrapy.signals.
+#
+# See documentation in:
+# https://docs.scrapy.org/en/latest/topics/signals.html
+
+# A request finished one stage of its life: stage (str), seconds (float),
+# request, spider. Sent by StageTimingMiddleware and ParseTimingMiddleware.
+stage_timed = object()
+
+# Everything a leased frontier request led to is scheduled: request, spider.
+# Sent by FrontierLeaseMiddleware and LeasedErrback, ends the lease.
+request_processed = object()
@@ -1,58 +1,254 @@
+import csv
 import datetime
+import json
 from urllib.parse import parse_qs, urlparse, urlencode, quote
-import dateparser
 import scrapy
+from scrapy import signals
+from scrapy.exceptions import DontCloseSpider
 from scrapy.http import Response
 from scrapy_playwright.page import PageMethod
 from playwright.async_api import Page
 from twisted.python.failure import Failure
 import uuid
 
+from crawler.dates import parse_date, parse_timestamp
+from crawler.index import AuctionIndex
+from crawler.items import Bid, CarRecord
+from crawler.pages import JsonCapture, scroll_until_stable
+from crawler.retry import RETRY_BUDGET, DeadLetters, attempt_value, failure_class
+
 
 class Carsandbids(scrapy.Spider):
     name = 'carsandbids'
     custom_settings = {
         "DOWNLOAD_DELAY": 0,
         "DOWNLOAD_HANDLERS": {
-            "http": "scrapy_playwright.handler.ScrapyPlaywrightDownloadHandler",
-            "https": "scrapy_playwright.handler.ScrapyPlaywrightDownloadHandler",
+            "http": "crawler.handlers.FetchModeDownloadHandler",
+            "https": "crawler.handlers.FetchModeDownloadHandler",
         }
     }
     playwright_args = {
         "playwright": True,
         "playwright_include_page": True,
+        # browser pages get a download slot of their own, sized by AdaptiveConcurrency
+        "download_slot": "browser",
+    }
+    impersonate_args = {
+        "impersonate": "chrome110",
     }
-    wait_timeout = 60*1000
+    fetch_modes = ('http', 'browser')
+    # selector and navigation timeouts per attempt, short first so a stuck page frees its slot early
+    selector_timeouts = (10*1000, 25*1000, 60*1000)
+    navigation_timeouts = (30*1000, 60*1000)
+    search_list_xpath = "//ul[contains(@class,'auctions-list past-auctions')]"
+    search_items_css = "ul.auctions-list.past-auctions > li"
+    car_links_xpath = "//ul[contains(@class, 'auctions-list')]/li//a[@class='hero']/@href"
+    quick_facts_xpath = "//div[contains(@class, 'quick-facts')]"
+    time_ended_xpath = "//span[@class='time-ended']/text()"
 
 
-    def __init__(self, car_year: str, car_make: str, car_model: str, car_trim: str, *args, **kwargs):
+    def __init__(self, car_year: str = '', car_make: str = '', car_model: str = '', car_trim: str = '',
+                 fetch_mode: str = 'http', full_refresh: str = '', queries_file: str = '', dead_letters: str = '',
+                 *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.user_args = [car_year.strip(), car_make.strip(), car_model.strip(), car_trim.strip()]
+        self.queries = self.load_queries(queries_file) if queries_file else [self.user_args]
+        # auction url -> every search query it showed up under
+        self.auction_queries = {}
+        # in batch mode auction pages wait until all searches are done, so that
+        # each item carries the full list of queries it matched
+        self.pending_cars = []
+        if fetch_mode not in self.fetch_modes:
+            raise ValueError(f"fetch_mode must be one of {self.fetch_modes}, got {fetch_mode!r}")
+        self.fetch_mode = fetch_mode
+        self.full_refresh = str(full_refresh).lower() in ('1', 'true', 'yes')
+        self.index = None
+        # dead-letter file to replay instead of, or on top of, the searches
+        self.replay_path = dead_letters
+        self.dead_letters = None
+        self.retry_budget = dict(RETRY_BUDGET)
+
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super().from_crawler(crawler, *args, **kwargs)
+        crawler.signals.connect(spider.spider_idle, signal=signals.spider_idle)
+        index_path = crawler.settings.get("CARSANDBIDS_INDEX_PATH")
+        if index_path:
+            spider.index = AuctionIndex(index_path)
+        dead_letter_path = crawler.settings.get("CARSANDBIDS_DEAD_LETTER_PATH")
+        if dead_letter_path:
+            spider.dead_letters = DeadLetters(dead_letter_path)
+        spider.retry_budget.update(crawler.settings.getdict("CARSANDBIDS_RETRY_BUDGET"))
+        spider.selector_timeouts = crawler.settings.getlist("CARSANDBIDS_SELECTOR_TIMEOUTS", spider.selector_timeouts)
+        spider.navigation_timeouts = crawler.settings.getlist("CARSANDBIDS_NAVIGATION_TIMEOUTS", spider.navigation_timeouts)
+        return spider
+
+
+    def closed(self, reason):
+        if self.index is not None:
+            self.index.close()
+        if self.dead_letters is not None:
+            self.dead_letters.close()
+
+
+    @staticmethod
+    def load_queries(path: str) -> list:
+        """ [year, make, model, trim] lists from a CSV (with a header row) or JSONL file """
+        fields = ('year', 'make', 'model', 'trim')
+        with open(path, newline='', encoding='utf-8') as f:
+            if path.endswith('.jsonl'):
+                rows = [json.loads(line) for line in f if line.strip()]
+            else:
+                rows = list(csv.DictReader(f))
+        return [[str(row.get(field) or '').strip() for field in fields] for row in rows]
 
 
-    def construct_url(self) -> str:
-        query = ' '.join(arg for arg in self.user_args if arg != '')
+    @property
+    def batch(self) -> bool:
+        return len(self.queries) > 1
+
+
+    @staticmethod
+    def query_string(user_args: list) -> str:
+        return ' '.join(arg for arg in user_args if arg != '')
+
+
+    def construct_url(self, user_args: list = None) -> str:
+        query = self.query_string(user_args or self.user_args)
         url = f"https://carsandbids.com/search?q={quote(query)}"
         return url
 
 
+    @staticmethod
+    def page_number(url: str) -> int:
+        page = parse_qs(urlparse(url).query).get('page', ['1'])[0]
+        return int(page) if page.isdigit() else 1
+
+
+    @staticmethod
+    def page_url(url: str, page: int) -> str:
+        """ `url` with its `page` query parameter set, encoded the same way as construct_url """
+        query = parse_qs(urlparse(url).query, keep_blank_values=True)
+        query['page'] = [str(page)]
+        return urlparse(url)._replace(query=urlencode(query, doseq=True, quote_via=quote)).geturl()
+
+
+    @staticmethod
+    def page_numbers(response: Response) -> list:
+        """ page numbers shown in the results paginator, which may be a window around the current page """
+        numbers = response.xpath("//li[contains(@class, 'arrow next')]/parent::*/li/button/text()").re(r'^\s*(\d+)\s*$')
+        return sorted(set(map(int, numbers)))
+
+
+    def search_request(self, url: str, browser: bool = False, query: str = None, attempt: int = 0,
+                       **kwargs) -> scrapy.Request:
+        """ results page request, rendered only when `browser` is set or plain HTTP is disabled """
+        page_methods = [
+            PageMethod("wait_for_selector", selector=self.search_list_xpath,
+                       timeout=int(attempt_value(self.selector_timeouts, attempt))),
+            PageMethod(
+                scroll_until_stable,
+                selector=self.search_items_css,
+                max_rounds=self.settings.getint("CARSANDBIDS_SCROLL_MAX_ROUNDS", 20),
+                settle_timeout=self.settings.getint("CARSANDBIDS_SCROLL_SETTLE_TIMEOUT", 3000),
+                idle_time=self.settings.getint("CARSANDBIDS_SCROLL_IDLE_TIME", 500),
+                max_time=self.settings.getint("CARSANDBIDS_SCROLL_MAX_TIME", 60*1000),
+            ),
+        ]
+        # searches run ahead of auction pages so batch deduplication sees every query first
+        kwargs.setdefault("priority", 10)
+        return self._request(url, self.parse, page_methods, browser, {"query": query}, attempt, **kwargs)
+
+
+    def car_request(self, url: str, browser: bool = False, attempt: int = 0, **kwargs) -> scrapy.Request:
+        """ auction page request, rendered only when `browser` is set or plain HTTP is disabled """
+        page_methods = [
+            PageMethod("wait_for_selector", selector=self.quick_facts_xpath,
+                       timeout=int(attempt_value(self.selector_timeouts, attempt)))
+        ]
+        meta = {}
+        if (browser or self.fetch_mode == 'browser') and self.settings.getbool("CARSANDBIDS_NETWORK_CAPTURE"):
+            # the page's own API calls carry the whole bid and comment history
+            capture = JsonCapture(self.settings.get("CARSANDBIDS_CAPTURE_URL_PATTERN", r"/v2/autos/auctions/"))
+            page_methods.append(PageMethod(
+                capture.wait_for_responses, timeout=self.settings.getint("CARSANDBIDS_CAPTURE_WAIT", 5000)
+            ))
+            meta = {"network_capture": capture, "playwright_page_event_handlers": {"response": capture.on_response}}
+        return self._request(url, self.parse_car, page_methods, browser, meta, attempt, **kwargs)
+
+
+    def _request(self, url: str, callback, page_methods: list, browser: bool, meta: dict, attempt: int = 0,
+                 **kwargs) -> scrapy.Request:
+        meta = {**meta, "attempt": attempt}
+        if browser or self.fetch_mode == 'browser':
+            meta = {
+                **meta, **self.playwright_args,
+                "playwright_page_methods": page_methods,
+                "playwright_page_goto_kwargs": {"timeout": int(attempt_value(self.navigation_timeouts, attempt))},
+                "fetch_path": "playwright",
+            }
+        else:
+            meta = {**meta, **self.impersonate_args, "fetch_path": "http"}
+        return scrapy.Request(url, callback=callback, meta=meta, errback=self.close_on_err, **kwargs)
+
+
+    def needs_browser(self, response: Response, xpath: str) -> bool:
+        """ True when a plain HTTP response lacks what the rendered page would show """
+        fetch_path = response.meta.get("fetch_path", "playwright")
+        if fetch_path == "http" and not response.xpath(xpath):
+            self.crawler.stats.inc_value("carsandbids/fetch/http_rejected")
+            return True
+        self.crawler.stats.inc_value(f"carsandbids/fetch/{fetch_path}")
+        return False
+
+
+    async def start(self):
+        # Scrapy 2.13+ only calls start(), start_requests() stays for older versions
+        for request in self.start_requests():
+            yield request
+
+
     def start_requests(self):
-        url = self.construct_url()
-        yield scrapy.Request(
-            url,
-            callback=self.parse,
-            meta={
-                **self.playwright_args,
-                "playwright_page_methods": [
-                    PageMethod("wait_for_selector", selector="//ul[contains(@class,'auctions-list past-auctions')]", timeout=self.wait_timeout),
-                    PageMethod("evaluate", "window.scrollTo(0, document.body.scrollHeight / 2);"),
-                    PageMethod("wait_for_timeout", timeout=5*1000),
-                    PageMethod("evaluate", "window.scrollTo(0, document.body.scrollHeight);"),
-                    PageMethod("wait_for_timeout", timeout=5*1000),
-                ]
-            },
-            errback=self.close_on_err
-        )
+        # checked here rather than in __init__, offline re-parsing needs no query
+        has_query = any(arg for query in self.queries for arg in query)
+        if not has_query and not self.replay_path:
+            raise ValueError("Provide car_year/car_make/car_model/car_trim, a non-empty queries_file or dead_letters")
+        if self.replay_path:
+            yield from self.replay_dead_letters(self.replay_path)
+        if has_query:
+            for user_args in self.queries:
+                yield self.search_request(self.construct_url(user_args), query=self.query_string(user_args))
+
+
+    def replay_dead_letters(self, path: str):
+        """ requests again for the entries of a dead-letter file left by an earlier run """
+        try:
+            entries = self.dead_letters.take(path) if self.dead_letters is not None else DeadLetters.read(path)
+        except FileNotFoundError:
+            # another worker of a shared-frontier crawl already took it
+            self.logger.warning(f"No dead-letter file at {path}, nothing to replay")
+            return
+        self.logger.info(f"Replaying {len(entries)} dead letters from {path}")
+        self.crawler.stats.inc_value("carsandbids/dead_letters/replayed", len(entries))
+        # these failed before, a seen-set kept from that run must not filter them
+        for entry in entries:
+            if entry["callback"] == "parse":
+                yield self.search_request(entry["url"], query=entry.get("query"), dont_filter=True)
+            else:
+                self.auction_queries.setdefault(entry["url"], list(entry.get("queries") or []))
+                yield self.car_request(entry["url"], dont_filter=True)
+
+
+    def spider_idle(self, spider):
+        """ batch mode: every search is done, fetch the deduplicated auctions """
+        if not self.pending_cars:
+            return
+        self.logger.info(f"Searches done, fetching {len(self.pending_cars)} unique auctions")
+        for link in self.pending_cars:
+            self.crawler.engine.crawl(self.car_request(link))
+        self.pending_cars = []
+        raise DontCloseSpider
 
 
     async def parse(self, response: Response, **kwargs):
@@ -60,41 +256,42 @@ class Carsandbids(scrapy.Spider):
         page: Page = response.meta.get("playwright_page")
         if page and not page.is_closed():
             await page.close()
-        cars_count = len(response.xpath("//ul[contains(@class, 'auctions-list')]/li//a[@class='hero']/@href").getall())
-        self.logger.info(f"Cars: {cars_count}")
-        for link in response.xpath("//ul[contains(@class, 'auctions-list')]/li//a[@class='hero']/@href").getall():
-            yield scrapy.Request(
-                url=response.urljoin(link),
-                callback=self.parse_car,
-                meta={
-                    **self.playwright_args,
-                    "playwright_page_methods": [
-                        PageMethod("wait_for_selector", selector="//div[contains(@class, 'quick-facts')]", timeout=self.wait_timeout)
-                    ]
-                },
-                errback=self.close_on_err
-            )
+        if self.needs_browser(response, self.car_links_xpath):
+            yield self.search_request(response.url, browser=True, query=response.meta.get("query"), dont_filter=True)
+            return
+        links = [response.urljoin(link) for link in response.xpath(self.car_links_xpath).getall()]
+        self.logger.info(f"Cars: {len(links)}")
+        skip = set()
+        if self.index is not None and not self.full_refresh:
+            skip = self.index.ended(links)
+            self.crawler.stats.inc_value("carsandbids/index/skipped", len(skip))
+        query = response.meta.get("query")
+        for link in links:
+            if link in skip:
+                continue
+            if link in self.auction_queries:
+                if query not in self.auction_queries[link]:
+                    self.auction_queries[link].append(query)
+                self.crawler.stats.inc_value("carsandbids/batch/duplicates")
+                continue
+            self.auction_queries[link] = [query]
+            if self.batch:
+                self.pending_cars.append(link)
+            else:
+                yield self.car_request(link)
 
+        # every page number the paginator shows past this one is scheduled at once; the
+        # paginator may only show a window of pages, so each page does the same and the
+        # dupefilter drops the ones already scheduled. The next-page button is only a
+        # fallback for when no higher number is shown
+        current_page = self.page_number(response.url)
         next_page = response.xpath("//li[@class='arrow next']/button[not(@disabled)]")
-        if next_page:
-            query = parse_qs(urlparse(self.url).query)
-            query['page'] = int(query['page'][0]) + 1 if 'page' in query else 2
-            self.url = urlparse(self.url)._replace(query=urlencode(query)).geturl()
-            yield scrapy.Request(
-                url=self.url,
-                callback=self.parse,
-                meta={
-                    **self.playwright_args,
-                    "playwright_page_methods": [
-                        PageMethod("wait_for_selector", selector="//ul[contains(@class,'auctions-list past-auctions')]", timeout=self.wait_timeout),
-                        PageMethod("evaluate", "window.scrollTo(0, document.body.scrollHeight / 2);"),
-                        PageMethod("wait_for_timeout", timeout=5*1000),
-                        PageMethod("evaluate", "window.scrollTo(0, document.body.scrollHeight);"),
-                        PageMethod("wait_for_timeout", timeout=5*1000),
-                    ]
-                },
-                errback=self.close_on_err
-            )
+        later_pages = [number for number in self.page_numbers(response) if number > current_page]
+        if not later_pages and next_page:
+            later_pages = [current_page + 1]
+        self.crawler.stats.inc_value("carsandbids/pagination/pages", len(later_pages))
+        for number in later_pages:
+            yield self.search_request(self.page_url(response.request.url, number), query=query)
 
 
     async def parse_car(self, response: Response):
@@ -102,50 +299,53 @@ class Carsandbids(scrapy.Spider):
         page: Page = response.meta.get("playwright_page")
         if page and not page.is_closed():
             await page.close()
+        if self.needs_browser(response, self.quick_facts_xpath):
+            return self.car_request(response.url, browser=True, dont_filter=True)
         source = 'carsandbids.com'
         year =  response.xpath("//title/text()").re_first('\d{4}')
         description = "".join(response.xpath("//div[contains(@class, 'auction-title')]/following-sibling::div/h2/text()").getall())
         price = "".join(response.xpath("//div[contains(@class, 'current-bid')]//span[@class='bid-value']//text()").getall())
         comment_count = response.xpath("//li[@class='num-comments']/span[@class='value']/text()").get()
-        engine = response.xpath(f"//div[@class='quick-facts']//dl//dt[contains(text(), 'Engine')]/following-sibling::dd//text()").get()
-        drivetrain = response.xpath(f"//div[@class='quick-facts']//dl//dt[contains(text(), 'Drivetrain')]/following-sibling::dd//text()").get()
-        mileage = response.xpath(f"//div[@class='quick-facts']//dl//dt[contains(text(), 'Mileage')]/following-sibling::dd//text()").get()
-        vin = response.xpath(f"//div[@class='quick-facts']//dl//dt[contains(text(), 'VIN')]/following-sibling::dd//text()").get()
-        transmission = response.xpath(f"//div[@class='quick-facts']//dl//dt[contains(text(), 'Transmission')]/following-sibling::dd//text()").get()
-        exterior = response.xpath(f"//div[@class='quick-facts']//dl//dt[contains(text(), 'Exterior Color')]/following-sibling::dd//text()").get()
-        interior = response.xpath(f"//div[@class='quick-facts']//dl//dt[contains(text(), 'Interior Color')]/following-sibling::dd//text()").get()
-        body_style = response.xpath(f"//div[@class='quick-facts']//dl//dt[contains(text(), 'Body Style')]/following-sibling::dd//text()").get()
-        model = response.xpath(f"//div[@class='quick-facts']//dl//dt[contains(text(), 'Model')]/following-sibling::dd//text()").get()
-        make = response.xpath(f"//div[@class='quick-facts']//dl//dt[contains(text(), 'Make')]/following-sibling::dd//text()").get()
-        location = response.xpath(f"//div[@class='quick-facts']//dl//dt[contains(text(), 'Location')]/following-sibling::dd//text()").get()
-        seller = response.xpath(f"//div[@class='quick-facts']//dl//dt[contains(text(), 'Seller')]/following-sibling::dd//text()").get()
-        seller_type = response.xpath(f"//div[@class='quick-facts']//dl//dt[contains(text(), 'Seller Type')]/following-sibling::dd//text()").get()
+        captured = self.network_entries(response.meta["network_capture"].payloads) \
+            if response.meta.get("network_capture") else []
+        quick_facts = self.extract_quick_facts(response)
+        engine = quick_facts.get('Engine')
+        drivetrain = quick_facts.get('Drivetrain')
+        mileage = quick_facts.get('Mileage')
+        vin = quick_facts.get('VIN')
+        transmission = quick_facts.get('Transmission')
+        exterior = quick_facts.get('Exterior Color')
+        interior = quick_facts.get('Interior Color')
+        body_style = quick_facts.get('Body Style')
+        model = quick_facts.get('Model')
+        make = quick_facts.get('Make')
+        location = quick_facts.get('Location')
+        seller = quick_facts.get('Seller')
+        seller_type = quick_facts.get('Seller Type')
 
         no_reserve = response.xpath("//div[@class='row auction-heading']//span[@class='no-reserve']")
         reserve = False if no_reserve else True
-        auction_end_date = self.convert_date_string("".join(response.xpath("//span[@class='time-ended']/text()").getall()))
+        time_ended = response.xpath(self.time_ended_xpath).getall()
+        auction_end_date = self.convert_date_string("".join(time_ended))
         bid_count = response.xpath("//li[@class='num-bids']/span[@class='value']/text()").get()
-        comments = []
-        try:
-            for comment in response.xpath("//li[@class='comment']"):
-                text = " ".join(comment.xpath(".//div[@class='message']//text()").getall())
-                comments.append(text)
-        except Exception:
-            pass
-        title_status = response.xpath(f"//div[@class='quick-facts']//dl//dt[contains(text(), 'Title Status')]/following-sibling::dd//text()").get()
-        bids = []
-        try:
-            for bid in response.xpath("//li[@class='bid']"):
-                bids.append({
-                    "bidder": bid.xpath(".//div[@class='username']//div[@class='text']//a[@class='user']/@title").get(),
-                    "amount": "".join(bid.xpath(".//dd/text()").getall()),
-                    "timestamp": int(dateparser.parse(
-                        bid.xpath(".//div[@class='text']//span[@class='time']/@data-full").get()).timestamp())
-                })
-        except Exception:
-            pass
-
-        return dict(
+        comments = self.extract_network_comments(captured)
+        title_status = quick_facts.get('Title Status')
+        bids = self.extract_network_bids(captured)
+        # the DOM only has what the page rendered, it is the fallback when nothing was captured
+        if captured:
+            self.crawler.stats.inc_value("carsandbids/capture/network")
+        else:
+            self.crawler.stats.inc_value("carsandbids/capture/dom")
+        if not comments:
+            comments = self.extract_comments(response)
+        if not bids:
+            bids = self.extract_bids(response)
+
+        if self.index is not None:
+            status = AuctionIndex.ENDED if time_ended else AuctionIndex.LIVE
+            self.index.record(response.request.url, vin, status)
+
+        return CarRecord(
             source=source,
             year=year,
             description=description,
@@ -170,22 +370,154 @@ class Carsandbids(scrapy.Spider):
             comment_text=comments,
             title_status=title_status,
             bids=bids,
+            queries=list(self.auction_queries.get(response.request.url, [])),
             source_page=response.url
         )
 
 
+    @staticmethod
+    def extract_comments(response: Response) -> list:
+        comments = []
+        for comment in response.xpath("//li[@class='comment']"):
+            comments.append(" ".join(comment.xpath(".//div[@class='message']//text()").getall()))
+        return comments
+
+
+    def extract_bids(self, response: Response) -> list:
+        bids = []
+        for bid in response.xpath("//li[@class='bid']"):
+            timestamp = parse_timestamp(bid.xpath(".//div[@class='text']//span[@class='time']/@data-full").get())
+            if timestamp is None:
+                self.crawler.stats.inc_value("carsandbids/bids/timestamp_failed")
+                continue
+            bids.append(Bid(
+                bidder=bid.xpath(".//div[@class='username']//div[@class='text']//a[@class='user']/@title").get(),
+                amount="".join(bid.xpath(".//dd/text()").getall()),
+                timestamp=timestamp,
+            ))
+        return bids
+
+
+    @staticmethod
+    def network_entries(payloads: list) -> list:
+        """ bid and comment objects found anywhere in captured API responses, each once, newest first """
+        entries = {}
+        stack = list(payloads)
+        while stack:
+            node = stack.pop()
+            if isinstance(node, list):
+                stack.extend(node)
+                continue
+            if not isinstance(node, dict):
+                continue
+            kind = node.get('type')
+            if kind is None and any(key in node for key in ('created', 'created_at', 'timestamp')):
+                kind = 'bid' if 'amount' in node else 'comment' if 'text' in node else None
+            if kind in ('bid', 'comment'):
+                key = node.get('id') or json.dumps(node, sort_keys=True, default=str)
+                entries.setdefault((kind, key), node)
+            stack.extend(value for value in node.values() if isinstance(value, (list, dict)))
+        found = [(kind, node, Carsandbids.network_timestamp(node)) for (kind, _), node in entries.items()]
+        found.sort(key=lambda entry: entry[2] or 0, reverse=True)
+        return found
+
+
+    @staticmethod
+    def network_timestamp(node: dict):
+        value = next((node[key] for key in ('created', 'created_at', 'timestamp') if node.get(key)), None)
+        if isinstance(value, (int, float)):
+            # epoch seconds, or milliseconds from JavaScript
+            return int(value / 1000 if value > 1e11 else value)
+        return parse_timestamp(value) if isinstance(value, str) else None
+
+
+    def extract_network_bids(self, entries: list) -> list:
+        bids = []
+        for kind, node, timestamp in entries:
+            if kind != 'bid':
+                continue
+            if timestamp is None:
+                self.crawler.stats.inc_value("carsandbids/bids/timestamp_failed")
+                continue
+            user = node.get('user')
+            amount = node.get('amount')
+            bids.append(Bid(
+                bidder=user.get('username') if isinstance(user, dict) else user or node.get('username'),
+                # same text as the page shows, e.g. "$12,345"
+                amount=f"${amount:,.0f}" if isinstance(amount, (int, float)) else amount,
+                timestamp=timestamp,
+            ))
+        return bids
+
+
+    @staticmethod
+    def extract_network_comments(entries: list) -> list:
+        return [node.get('text') or '' for kind, node, _ in entries if kind == 'comment']
+
+
+    @staticmethod
+    def extract_quick_facts(response: Response) -> dict:
+        """ exact label -> value map of the quick-facts lists, built in a single pass """
+        facts = {}
+        label = None
+        for node in response.xpath("//div[@class='quick-facts']//dl/*"):
+            element = node.root
+            if element.tag == 'dt':
+                label = " ".join("".join(element.itertext()).split())
+            elif element.tag == 'dd' and label is not None:
+                # like the old `following-sibling::dd//text()`: first text node of the value
+                facts.setdefault(label, next(element.itertext(), None))
+                label = None
+        return facts
+
+
+    def retry_request(self, request: scrapy.Request, browser: bool = False, attempt: int = 0) -> scrapy.Request:
+        """ fresh search or auction request for the same URL, built for the given attempt """
+        browser = browser or request.meta.get("fetch_path") == "playwright"
+        kwargs = dict(browser=browser, attempt=attempt, dont_filter=True)
+        if attempt:
+            kwargs["priority"] = request.priority + self.settings.getint("RETRY_PRIORITY_ADJUST", -1)
+        if request.callback == self.parse:
+            retry = self.search_request(request.url, query=request.meta.get("query"), **kwargs)
+        else:
+            retry = self.car_request(request.url, **kwargs)
+        retry.meta["failures"] = dict(request.meta.get("failures") or {})
+        return retry
+
+
     async def close_on_err(self, failure: Failure):
-        page: Page = failure.request.meta.get("playwright_page")
-        self.logger.error(failure.value)
+        """ falls back to the browser, retries within the failure's budget, dead-letters the rest """
+        request = failure.request
+        page: Page = request.meta.get("playwright_page")
         if page and not page.is_closed():
             await page.close()
+        if request.meta.get("fetch_path") == "http":
+            self.logger.warning(f"HTTP fetch of {request.url} failed, using the browser: {failure.value!r}")
+            self.crawler.stats.inc_value("carsandbids/fetch/http_failed")
+            return self.retry_request(request, browser=True, attempt=request.meta.get("attempt", 0))
+
+        kind = failure_class(failure)
+        failures = dict(request.meta.get("failures") or {})
+        failures[kind] = failures.get(kind, 0) + 1
+        attempts = request.meta.get("attempt", 0) + 1
+        if failures[kind] <= self.retry_budget.get(kind, 0):
+            self.logger.warning(f"Retrying {request.url} after {kind} failure {failures[kind]}: {failure.value!r}")
+            self.crawler.stats.inc_value(f"carsandbids/retry/{kind}")
+            retry = self.retry_request(request, attempt=attempts)
+            retry.meta["failures"] = failures
+            return retry
+
+        self.logger.error(f"Giving up on {request.url} after {attempts} attempts: {failure.value!r}")
+        self.crawler.stats.inc_value(f"carsandbids/retry/exhausted/{kind}")
+        if self.dead_letters is not None:
+            callback = getattr(request.callback, "__name__", "parse_car")
+            extra = {"query": request.meta.get("query")} if callback == "parse" else \
+                {"queries": list(self.auction_queries.get(request.url, []))}
+            self.dead_letters.write(request.url, callback, kind, repr(failure.value), attempts, **extra)
+            self.crawler.stats.inc_value("carsandbids/dead_letters/written")
 
 
     @staticmethod
     def convert_date_string(date_str):
-        try:
-            formatted_date_str = dateparser.parse(date_str).strftime(f'%m/%d/%Y')
-            return formatted_date_str
-        except Exception:
-            today = datetime.datetime.today().strftime(f'%m/%d/%Y')
-            return today
+        date = parse_date(date_str) or datetime.datetime.today()
+        return date.strftime(f'%m/%d/%Y')
@@ -0,0 +1,267 @@
+import heapq
+import time
+
+from scrapy import signals
+from scrapy.exceptions import DontCloseSpider
+from scrapy.http import Response
+from playwright.async_api import Page
+from twisted.internet import task
+from twisted.python.failure import Failure
+
+from crawler.dates import parse_countdown, parse_timestamp
+from crawler.items import AuctionDelta, CarRecord
+from crawler.spiders.carsandbids import Carsandbids
+
+
+class CarsandbidsWatch(Carsandbids):
+    """
+    Long-running watch of live auctions: found through the searches given (or the
+    home page without any), then refreshed on a schedule kept in a heap ordered by
+    when each auction is due, more often the closer it is to ending. Only changes
+    of price, bid count and bids are emitted, as AuctionDelta items, until the
+    auction ends. Searches are run again every WATCH_DISCOVERY_INTERVAL seconds to
+    pick up new auctions.
+
+        scrapy crawl carsandbids_watch -a car_make=porsche -a fetch_mode=browser
+    """
+    name = 'carsandbids_watch'
+    custom_settings = {
+        **Carsandbids.custom_settings,
+        # deltas aren't car items, and every refresh would land in the archive
+        "ITEM_PIPELINES": {},
+        "HTML_ARCHIVE_DIR": None,
+        # failed refreshes go back on the schedule, a replay by the main spider would scrape them as ended auctions
+        "CARSANDBIDS_DEAD_LETTER_PATH": None,
+        "FEEDS": {"watch/%(name)s-%(time)s.jsonl": {"format": "jsonlines"}},
+    }
+    live_url = "https://carsandbids.com/"
+    search_list_xpath = "//ul[contains(@class, 'auctions-list')]"
+    search_items_css = "ul.auctions-list > li"
+    car_links_xpath = "//ul[contains(@class, 'auctions-list') and not(contains(@class, 'past-auctions'))]/li//a[@class='hero']/@href"
+    time_left_xpath = "//*[contains(@class, 'ticking') or contains(@class, 'time-left')]//text()"
+    # end time keys of the auction object in captured API responses
+    end_time_keys = ('auction_end', 'auction_end_time', 'end_time', 'ends_at')
+    # (seconds left up to, refresh every) pairs, checked in order
+    refresh_schedule = ((2*60, 10), (15*60, 30), (60*60, 2*60), (24*60*60, 15*60))
+    refresh_default = 60*60
+    refresh_unknown = 10*60
+
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # (due, url) entries; a URL's current one is in `due`, older entries are skipped
+        self.heap = []
+        self.due = {}
+        self.in_flight = set()
+        # url -> (price, bid_count, bid keys) of the previous check
+        self.last_seen = {}
+        # url -> seconds left at the previous check, and when that was
+        self.ends_in = {}
+        self.checked_at = {}
+        self.next_discovery = 0
+        self.loop = None
+
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super().from_crawler(crawler, *args, **kwargs)
+        settings = crawler.settings
+        spider.refresh_schedule = tuple(tuple(pair) for pair in settings.getlist("WATCH_REFRESH_SCHEDULE", spider.refresh_schedule))
+        spider.refresh_default = settings.getint("WATCH_REFRESH_DEFAULT", spider.refresh_default)
+        spider.discovery_interval = settings.getint("WATCH_DISCOVERY_INTERVAL", 30*60)
+        spider.tick = settings.getfloat("WATCH_TICK", 1)
+        crawler.signals.connect(spider.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(spider.request_dropped, signal=signals.request_dropped)
+        return spider
+
+
+    def spider_opened(self, spider):
+        self.next_discovery = time.time() + self.discovery_interval
+        self.loop = task.LoopingCall(self.schedule_due)
+        self.loop.start(self.tick, now=False)
+
+
+    def request_dropped(self, request, spider):
+        """ a refresh the scheduler refused never reaches a callback, put it back on the schedule """
+        if request.url in self.in_flight:
+            self.in_flight.discard(request.url)
+            self.track(request.url, self.time_left(request.url))
+
+
+    def closed(self, reason):
+        if self.loop is not None and self.loop.running:
+            self.loop.stop()
+        super().closed(reason)
+
+
+    def start_requests(self):
+        yield from self.discovery_requests()
+
+
+    def discovery_requests(self) -> list:
+        """ searches listing live auctions, the home page when no query was given """
+        queries = [user_args for user_args in self.queries if any(user_args)]
+        if not queries:
+            return [self.search_request(self.live_url, dont_filter=True)]
+        return [
+            self.search_request(self.construct_url(user_args), query=self.query_string(user_args), dont_filter=True)
+            for user_args in queries
+        ]
+
+
+    def refresh_interval(self, seconds_left) -> int:
+        if seconds_left is None:
+            return self.refresh_unknown
+        for up_to, interval in self.refresh_schedule:
+            if seconds_left <= up_to:
+                return interval
+        return self.refresh_default
+
+
+    def schedule(self, url: str, due: float):
+        self.due[url] = due
+        heapq.heappush(self.heap, (due, url))
+
+
+    def track(self, url: str, seconds_left=None, now: float = None):
+        """ schedules the next check of an auction after one just done """
+        now = now or time.time()
+        due = now + self.refresh_interval(seconds_left)
+        if seconds_left is not None:
+            # never sleep through the end, soft-close extensions are caught by the next check
+            due = min(due, now + max(seconds_left, 0) + 5)
+        self.ends_in[url] = seconds_left
+        self.checked_at[url] = now
+        self.schedule(url, due)
+
+
+    def time_left(self, url: str, now: float = None):
+        """ seconds left going by the last check, for rescheduling a refresh that didn't get through """
+        seconds_left = self.ends_in.get(url)
+        if seconds_left is None:
+            return None
+        now = now or time.time()
+        return seconds_left - (now - self.checked_at.get(url, now))
+
+
+    def untrack(self, url: str):
+        self.due.pop(url, None)
+        self.last_seen.pop(url, None)
+        self.ends_in.pop(url, None)
+        self.checked_at.pop(url, None)
+        self.auction_queries.pop(url, None)
+
+
+    def schedule_due(self):
+        """ crawls every auction whose check is due, and the discovery searches when it's time """
+        now = time.time()
+        while self.heap and self.heap[0][0] <= now:
+            due, url = heapq.heappop(self.heap)
+            if self.due.get(url) != due or url in self.in_flight:
+                continue
+            del self.due[url]
+            self.in_flight.add(url)
+            self.crawler.stats.inc_value("carsandbids_watch/refreshes")
+            # the sooner it ends, the sooner it goes
+            priority = -int(self.ends_in.get(url) or 0) // 60
+            self.crawler.engine.crawl(self.car_request(url, dont_filter=True, priority=priority))
+        if self.discovery_interval and now >= self.next_discovery:
+            self.next_discovery = now + self.discovery_interval
+            for request in self.discovery_requests():
+                self.crawler.engine.crawl(request)
+
+
+    def spider_idle(self, spider):
+        """ nothing to download right now, but tracked auctions come due later """
+        if self.due or self.in_flight or self.discovery_interval:
+            raise DontCloseSpider
+
+
+    async def parse(self, response: Response, **kwargs):
+        """ live auctions of a search, or of the home page """
+        page: Page = response.meta.get("playwright_page")
+        if page and not page.is_closed():
+            await page.close()
+        if self.needs_browser(response, self.car_links_xpath):
+            yield self.search_request(response.url, browser=True, query=response.meta.get("query"), dont_filter=True)
+            return
+        found = 0
+        for link in response.xpath(self.car_links_xpath).getall():
+            url = response.urljoin(link)
+            if url in self.due or url in self.in_flight:
+                continue
+            self.auction_queries.setdefault(url, []).append(response.meta.get("query"))
+            self.schedule(url, time.time())
+            found += 1
+        self.crawler.stats.inc_value("carsandbids_watch/discovered", found)
+        self.logger.info(f"Live auctions: {found} new, {len(self.due) + len(self.in_flight)} tracked")
+
+
+    def seconds_left(self, response: Response, now: float):
+        """ from the end time in captured API responses, else from the page's countdown """
+        capture = response.meta.get("network_capture")
+        for payload in capture.payloads if capture else ():
+            auction = payload.get('auction', payload) if isinstance(payload, dict) else None
+            end = next((auction[key] for key in self.end_time_keys if isinstance(auction, dict) and auction.get(key)), None)
+            ends_at = parse_timestamp(end) if isinstance(end, str) else end
+            if isinstance(ends_at, (int, float)):
+                return int(ends_at / 1000 if ends_at > 1e11 else ends_at) - int(now)
+        return parse_countdown(" ".join(response.xpath(self.time_left_xpath).getall()))
+
+
+    def delta(self, url: str, record: CarRecord, ended: bool, seconds_left, now: float):
+        """ AuctionDelta against the previous check of `url`, None when nothing changed """
+        first = url not in self.last_seen
+        previous_price, previous_bid_count, previous_keys = self.last_seen.get(url, (None, None, frozenset()))
+        new_bids = [bid for bid in record.bids if (bid.timestamp, bid.amount, bid.bidder) not in previous_keys]
+        self.last_seen[url] = (
+            record.price, record.bid_count, frozenset((bid.timestamp, bid.amount, bid.bidder) for bid in record.bids)
+        )
+        if not first and not ended and not new_bids \
+                and record.price == previous_price and record.bid_count == previous_bid_count:
+            return None
+        return AuctionDelta(
+            source_page=record.source_page,
+            observed_at=int(now),
+            ended=ended,
+            seconds_left=seconds_left,
+            price=record.price,
+            previous_price=previous_price,
+            bid_count=record.bid_count,
+            previous_bid_count=previous_bid_count,
+            new_bids=new_bids,
+        )
+
+
+    async def parse_car(self, response: Response):
+        """ one check of a live auction """
+        ended = bool(response.xpath(self.time_ended_xpath))
+        record = await super().parse_car(response)
+        if not isinstance(record, CarRecord):
+            # a browser fallback of a plain HTTP fetch, the check isn't over yet
+            return record
+        url = response.request.url
+        now = time.time()
+        seconds_left = None if ended else self.seconds_left(response, now)
+        self.in_flight.discard(url)
+        delta = self.delta(url, record, ended, seconds_left, now)
+        if ended:
+            self.untrack(url)
+            self.crawler.stats.inc_value("carsandbids_watch/ended")
+        else:
+            self.track(url, seconds_left, now)
+        if delta is None:
+            self.crawler.stats.inc_value("carsandbids_watch/unchanged")
+            return None
+        self.crawler.stats.inc_value("carsandbids_watch/deltas")
+        return delta
+
+
+    async def close_on_err(self, failure: Failure):
+        retry = await super().close_on_err(failure)
+        url = failure.request.url
+        if retry is None and url in self.in_flight:
+            # out of retries: try again on the regular schedule rather than dropping the auction
+            self.in_flight.discard(url)
+            self.track(url, self.time_left(url))
+        return retry
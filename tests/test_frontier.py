@@ -0,0 +1,99 @@
+import time
+
+import pytest
+from scrapy import Request, Spider, signals
+from scrapy.utils.test import get_crawler
+
+from crawler.frontier import SharedScheduler, SqliteFrontier
+from crawler.signals import request_processed
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "frontier.sqlite")
+
+
+def frontiers(path, crawl="test", lease_timeout=600):
+    """ two workers' connections to one frontier file """
+    return SqliteFrontier(path, crawl, lease_timeout), SqliteFrontier(path, crawl, lease_timeout)
+
+
+def test_seen_set_is_shared(path):
+    a, b = frontiers(path)
+    assert a.add_seen("fp")
+    assert not b.add_seen("fp")
+    assert SqliteFrontier(path, "other").add_seen("fp")
+
+
+def test_pop_is_exclusive(path):
+    a, b = frontiers(path)
+    a.push("fp1", 0, b"one")
+    a.push("fp2", 5, b"two")
+    first, second = b.pop("b"), a.pop("a")
+    assert first[1] == b"two" and second[1] == b"one"
+    assert a.pop("a") is None and b.pop("b") is None
+    assert (a.queued(), a.leased()) == (0, 2)
+    b.done(first[0])
+    assert (a.queued(), a.leased()) == (0, 1)
+
+
+def test_expired_lease_is_handed_out_again(path):
+    a, b = frontiers(path, lease_timeout=0.2)
+    a.push("fp", 0, b"data")
+    request_id, _ = a.pop("a")
+    assert b.pop("b") is None
+    time.sleep(0.3)
+    assert (b.queued(), b.leased()) == (1, 0)
+    assert b.pop("b") == (request_id, b"data")
+
+
+def test_reset_refuses_while_requests_remain(path):
+    a, b = frontiers(path)
+    a.add_seen("fp")
+    a.push("fp", 0, b"data")
+    request_id, _ = a.pop("a")
+    assert not b.reset()
+    assert not b.add_seen("fp")
+    a.done(request_id)
+    assert b.reset()
+    assert a.add_seen("fp")
+
+
+def scheduler(path):
+    crawler = get_crawler(Spider, {
+        "SCHEDULER": "crawler.frontier.SharedScheduler",
+        "FRONTIER_PATH": path,
+        "FRONTIER_CRAWL": "test",
+    })
+    scheduler = SharedScheduler.from_crawler(crawler)
+    scheduler.open(Spider.from_crawler(crawler, name="test"))
+    return crawler, scheduler
+
+
+def test_lease_outlives_download_until_callback_output_is_queued(path):
+    crawler_a, a = scheduler(path)
+    _, b = scheduler(path)
+    assert a.enqueue_request(Request("https://example.com/page-1"))
+    request = a.next_request()
+    # the download is over, the callback hasn't run yet
+    crawler_a.signals.send_catch_log(signals.request_left_downloader, request=request, spider=a.spider)
+    assert b.has_pending_requests()
+    b.close("finished")
+    # the other worker closing early must not have reset the crawl
+    assert not a.enqueue_request(Request("https://example.com/page-1"))
+    assert a.enqueue_request(Request("https://example.com/page-2"))
+    crawler_a.signals.send_catch_log(request_processed, request=request, spider=a.spider)
+    assert (a.frontier.queued(), a.frontier.leased()) == (1, 0)
+    a.close("finished")
+
+
+def test_retry_takes_over_the_lease(path):
+    _, a = scheduler(path)
+    a.enqueue_request(Request("https://example.com/page-1"))
+    request = a.next_request()
+    assert a.frontier.leased() == 1
+    a.enqueue_request(request.replace(dont_filter=True))
+    assert (a.frontier.queued(), a.frontier.leased()) == (1, 0)
+    retry = a.next_request()
+    assert retry.url == request.url and retry.errback is not request.errback
+    a.close("finished")